@@ -0,0 +1,189 @@
+import os
+
+import build_data
+import cache_files
+import league
+import records
+import schema
+
+"""
+Incremental season/career totals.
+
+Rather than reloading every boxscore and summing a whole season each time, the record of
+every game (a records.StatRecord, cached as its list of values) is cached on disk along
+with the hash of the boxscore file it came from, and running totals are kept per season
+and for the career.
+A nightly update then only has to load and add the games that are new since the last one:
+
+    python aggregate.py
+"""
+
+BOXSCORE_DIR = "data/boxscores"
+SEASON_DIR = "data/seasons"
+
+# Bump when the layout of a cached record changes, older caches are then thrown away
+CACHE_VERSION = 3
+
+
+def list_seasons(season_dir=SEASON_DIR):
+    return sorted(int(f[:4]) for f in os.listdir(season_dir) if f[:4].isdigit() and f.endswith(".csv"))
+
+def season_games(season, season_dir=SEASON_DIR):
+    """
+    Returns the dates (yyyymmdd) of the games in a season file that were actually played,
+    the games that were missed have no game number.
+    """
+    return list(build_data.season_dates(os.path.join(season_dir, str(season) + ".csv")))
+
+
+class SplitCache:
+    """
+    Cache of the record of every game, keyed by the game date and checked against the hash of
+    the boxscore file so that a re-downloaded file is loaded again. A file is only read and
+    hashed again if its mtime or size changed, so an update of a whole career only stats
+    the files it already has. Files are loaded through schema.py, so the ones that validated
+    clean take the fast path.
+    """
+    def __init__(self, fname=os.path.join(cache_files.CACHE_DIR, "splits.json"),
+                 boxscore_dir=BOXSCORE_DIR, ingest=None):
+        self.fname = fname
+        self.boxscore_dir = boxscore_dir
+        self.ingest = ingest if ingest is not None else schema.IngestLog()
+        data = cache_files.load_json(fname, {})
+        self.splits = data.get("splits", {}) if data.get("version") == CACHE_VERSION else {}
+        self.dirty = False
+
+    def load(self, date):
+        """
+        Returns (record, hash of the file it came from) for the game on date, the record is
+        None if LeBron didn't play in it.
+        """
+        fname = os.path.join(self.boxscore_dir, date + ".csv")
+        stat = os.stat(fname)
+        entry = self.splits.get(date)
+        if (entry is not None and entry.get("mtime") == stat.st_mtime_ns and
+                entry.get("size") == stat.st_size):
+            return self.record(entry), entry["hash"]
+
+        digest = cache_files.file_hash(fname)
+        if entry is None or entry["hash"] != digest:
+            record = records.from_typed_rows(schema.load_rows(fname, self.ingest))
+            entry = {"hash": digest, "values": None if record is None else record.values}
+            self.splits[date] = entry
+        # Touched but the same content, only the mtime gets updated
+        entry["mtime"] = stat.st_mtime_ns
+        entry["size"] = stat.st_size
+        self.dirty = True
+        return self.record(entry), digest
+
+    def record(self, entry):
+        # A copy, so adding it up never changes what's cached
+        return None if entry["values"] is None else records.StatRecord(list(entry["values"]))
+
+    def save(self):
+        self.ingest.save()
+        if self.dirty:
+            cache_files.save_json(self.fname, {"version": CACHE_VERSION, "splits": self.splits})
+            self.dirty = False
+
+
+class Totals:
+    """
+    Running totals (records.StatRecord values) of each season and of the career. Every
+    season remembers which games (and which version of the file, by hash) it is made of, so
+    adding one new game is a single sum of two records no matter how many games came before.
+    """
+    def __init__(self, fname=os.path.join(cache_files.CACHE_DIR, "totals.json")):
+        self.fname = fname
+        data = cache_files.load_json(fname, {})
+        if data.get("version") != CACHE_VERSION:
+            data = {"seasons": {}, "career": records.StatRecord().values}
+        self.seasons = data["seasons"]
+        self.career = records.StatRecord(data["career"])
+        # Seasons with a game that changed, they get summed up again from the cached records
+        self.stale = set()
+
+    def add(self, season, date, digest, record):
+        """
+        Adds the record of the game on date to its season and the career. Returns True if it
+        was a new game.
+        """
+        key = str(season)
+        entry = self.seasons.setdefault(key, {"games": {}, "totals": records.StatRecord().values})
+        old_digest = entry["games"].get(date)
+        if old_digest == digest:
+            return False
+
+        entry["games"][date] = digest
+        if old_digest is not None:
+            self.stale.add(key)
+            return False
+
+        if record is not None:
+            records.StatRecord(entry["totals"]).add(record)
+            self.career.add(record)
+        return True
+
+    def rebuild_stale(self, cache):
+        """
+        Sums the stale seasons up again from the cached records, then the career from the seasons.
+        """
+        if not self.stale:
+            return
+        for season in self.stale:
+            games = [cache.load(date)[0] for date in sorted(self.seasons[season]["games"])]
+            self.seasons[season]["totals"] = records.sum_records(
+                record for record in games if record is not None).values
+        self.career = records.sum_records(records.StatRecord(entry["totals"])
+                                          for entry in self.seasons.values())
+        self.stale = set()
+
+    def season_totals(self, season):
+        return records.StatRecord(list(self.seasons[str(season)]["totals"]))
+
+    def save(self):
+        cache_files.save_json(self.fname, {"version": CACHE_VERSION, "seasons": self.seasons,
+                                           "career": self.career.values})
+
+
+def update(seasons=None, cache=None, totals=None, season_dir=SEASON_DIR):
+    """
+    Brings the cached records and the running totals up to date with the season files and
+    the boxscores, only the games that are new (or whose file changed) get loaded. Returns
+    the number of new games.
+    """
+    if cache is None:
+        cache = SplitCache()
+    if totals is None:
+        totals = Totals()
+    if seasons is None:
+        seasons = list_seasons(season_dir)
+
+    new_games = 0
+    for season in seasons:
+        for date in season_games(season, season_dir):
+            record, digest = cache.load(date)
+            new_games += totals.add(season, date, digest, record)
+
+    totals.rebuild_stale(cache)
+    cache.save()
+    totals.save()
+    return new_games
+
+def season_stats(totals, season):
+    """
+    Returns the advanced stats of a whole season from the running totals, as a flat dict
+    like calculate_advanced_stats() gives.
+    """
+    record = totals.season_totals(season).with_league(league.league_info(int(season)))
+    stats = record.as_dict()
+    stats.update(records.rate(record))
+    return stats
+
+
+if __name__ == "__main__":
+    totals = Totals()
+    print("Added " + str(update(totals=totals)) + " new games")
+    for season in sorted(totals.seasons):
+        stats = season_stats(totals, season)
+        print(season + ": ORtg = " + str(stats["ORtg"]) + ", DRtg = " + str(stats["DRtg"]))
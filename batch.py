@@ -0,0 +1,69 @@
+import numpy as np
+
+import calc
+import league
+
+"""
+Vectorized evaluation of the calc.py formulas.
+
+Instead of calling the formulas once per game/player/season with a dict of numbers, the
+formulas are called once with column arrays that hold one element per row. The formulas
+themselves are the same functions as in calc.py, so the results match the scalar path.
+
+Rows that would raise a ZeroDivisionError in the scalar path are handled with masks:
+a player with no free throw (or field goal) attempts simply has no possessions from them,
+anything else that is undefined (e.g. a player with no possessions at all) comes out nan.
+"""
+
+OUTPUTS = ["ORtg", "DRtg", "OffensiveWinShares", "DefensiveWinShares", "PointsProduced",
+           "TotalPossessions"]
+
+
+class BatchRecord(calc.Context):
+    """
+    Holds the input columns as float arrays, scalars (e.g. the league info for a single
+    season) are allowed and broadcast against the rest. Like calc.Context every term is
+    only computed once per batch.
+    """
+    def __init__(self, columns):
+        super().__init__({key: np.asarray(val, dtype=np.float64) for key, val in columns.items()})
+
+    def evaluate_term(self, name, step):
+        key = calc.ZERO_WHEN_NONE.get(name)
+        none = None if key is None else self.data[key] == 0
+        if none is None or not none.any():
+            return step(self.data, self.values)
+        # Evaluate with the zeros swapped for 1s so the other rows are computed exactly as
+        # normal, then mask out the rows with no attempts
+        safe = {**self.data, key: np.where(none, 1.0, self.data[key])}
+        return np.where(none, 0.0, step(safe, self.values))
+
+    def size(self):
+        return np.broadcast_shapes(*[col.shape for col in self.data.values()])
+
+
+def columns_from_records(records, keys=None):
+    """
+    Turns a list of dicts (like the ones calculate_advanced_stats works on) into column
+    arrays. Only keys with numeric values are kept unless keys is given.
+    """
+    if keys is None:
+        keys = [key for key, val in records[0].items()
+                if isinstance(val, (int, float)) and not isinstance(val, bool)]
+    return {key: np.array([record[key] for record in records], dtype=np.float64) for key in keys}
+
+def evaluate(columns, metrics=OUTPUTS, dates=None):
+    """
+    Evaluates each of the calc.py functions named in metrics on the column arrays, returns
+    a dict of metric name -> array with one element per row. If dates (yyyymmdd, one per
+    row) is given, the league info columns of each row's season are added from
+    League_Data.csv.
+    """
+    if dates is not None:
+        columns = {**columns, **league.league_columns(dates)}
+    record = columns if isinstance(columns, BatchRecord) else BatchRecord(columns)
+    shape = record.size()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        results = calc.evaluate(record, metrics)
+    return {metric: np.broadcast_to(val, shape) for metric, val in results.items()}
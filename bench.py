@@ -0,0 +1,462 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+"""
+Benchmarks for the scraper and the stats pipeline.
+
+    python bench.py parse [--games N]   -> per page parse time/peak memory of the boxscore
+                                           page parsers in pull_data.py
+    python bench.py parallel [--workers N]
+                                        -> wall clock of the serial season loop against
+                                           parallel.rate_seasons()
+    python bench.py pipeline [--scale N] [--output FILE]
+                                        -> time/throughput/peak memory of every stage of the
+                                           build_data/calc pipeline, on the real boxscores
+                                           (scale 1) or synthetic ones scaled N times. The
+                                           results are saved as JSON (see compare)
+    python bench.py compare OLD NEW     -> compares two pipeline result files
+    python bench.py league [--copies N] [--workers N]
+                                        -> builds the season partitions of a synthetic league
+                                           (N games on every date we have a boxscore for) and
+                                           rates every player of every season (partitions.py)
+    python bench.py startup [--runs N]  -> startup time of every cli.py command against its
+                                           budget (cli.STARTUP_BUDGET_MS), exits with 1 if
+                                           one is over
+"""
+
+BOXSCORE_DIR = "data/boxscores"
+FIXTURE_DIR = "bench_fixtures"
+RESULTS_DIR = "bench_results"
+
+# Synthetic boxscores are always generated from this seed, so every run at the same scale
+# works on exactly the same files
+FIXTURE_SEED = 2003
+GAMES_PER_SEASON = 82
+
+def load_boxscore_rows(fname):
+    with open(fname) as csvfile:
+        return list(csv.DictReader(csvfile))
+
+def boxscore_pages(games):
+    from tests.boxscore_pages import boxscore_page
+
+    fnames = sorted(os.listdir(BOXSCORE_DIR))[:games]
+    return [boxscore_page(load_boxscore_rows(os.path.join(BOXSCORE_DIR, f))) for f in fnames]
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def parse_worker(parser_name, pages):
+    """
+    Runs in a fresh process so one parser's imports and caches don't count for the other.
+    The peak is the most Python memory (tracemalloc) parsing a single page allocated on top
+    of what was already there, measured in a second pass so it doesn't slow the timed one.
+    """
+    import pull_data
+    parse = getattr(pull_data, parser_name)
+    # Warm up, so imports/first call costs aren't counted in the per page numbers
+    parse(pages[0])
+
+    times = []
+    for page in pages:
+        start = time.perf_counter()
+        parse(page)
+        times.append(time.perf_counter() - start)
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for page in pages:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            parse(page)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return {"times": times, "peak_kb": peak // 1024}
+
+def run_parse_benchmark(pages, parser_name):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(parse_worker, (parser_name, pages))
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        "mean_ms": 1000 * statistics.mean(times),
+        "p50_ms": 1000 * times[len(times) // 2],
+        "p95_ms": 1000 * times[int(len(times) * 0.95)],
+        "p99_ms": 1000 * times[int(len(times) * 0.99)],
+    }
+
+def bench_parse(args):
+    pages = boxscore_pages(args.games)
+    print("Parsing " + str(len(pages)) + " pages, " +
+          str(sum(len(p) for p in pages) // len(pages) // 1024) + " KB each on average")
+
+    report = {}
+    for parser_name in ["read_html_tables", "parse_boxscore_html"]:
+        result = run_parse_benchmark(pages, parser_name)
+        report[parser_name] = dict(summarize(result["times"]), peak_kb=result["peak_kb"])
+        print(parser_name + ": " + json.dumps(report[parser_name]))
+    return report
+
+
+def serial_seasons(seasons):
+    """
+    The season loop from build_data.py: load every boxscore of the season file, sum the
+    splits and calculate the stats, one season after the other.
+    """
+    import aggregate
+    import build_data
+
+    results = {}
+    for season in seasons:
+        splits = [build_data.load_boxscore_file(os.path.join(BOXSCORE_DIR, date + ".csv"))
+                  for date in aggregate.season_games(season)]
+        final = build_data.sum_splits(splits)
+        final["LeagueInfo"] = build_data.load_league_info(str(season) + "0101")
+        results[season] = build_data.calculate_advanced_stats(final)
+    return results
+
+def bench_parallel(args):
+    import aggregate
+    import parallel
+    import store
+
+    store.build_store()
+    seasons = aggregate.list_seasons()
+    season_dates = {season: aggregate.season_games(season) for season in seasons}
+
+    start = time.perf_counter()
+    serial = serial_seasons(seasons)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = parallel.rate_seasons(["LeBron James"], seasons, season_dates, workers=args.workers)
+    parallel_time = time.perf_counter() - start
+
+    max_diff = max(abs(serial[season][metric] - results[("LeBron James", season)][metric])
+                   for season in seasons for metric in ["ORtg", "DRtg", "OffensiveWinShares",
+                                                        "DefensiveWinShares"])
+    report = {"seasons": len(seasons), "workers": args.workers or os.cpu_count(),
+              "serial_s": serial_time, "parallel_s": parallel_time, "max_abs_diff": max_diff}
+    print(json.dumps(report))
+    return report
+
+
+def synthetic_boxscores(scale, fixture_dir=FIXTURE_DIR):
+    """
+    Makes scale times as many boxscore files as there are in data/boxscores, each one a copy
+    of a random real game (one LeBron played in) with the minutes and a few stats jittered.
+    Files are made with a fixed seed and kept, so they're only generated the first time.
+    Returns the sorted list of files.
+    """
+    out_dir = os.path.join(fixture_dir, "scale_" + str(scale))
+    sources = sorted(os.listdir(BOXSCORE_DIR))
+    count = len(sources) * scale
+    if os.path.isdir(out_dir) and len(os.listdir(out_dir)) == count:
+        return [os.path.join(out_dir, f) for f in sorted(os.listdir(out_dir))]
+
+    import build_data
+
+    print("Generating " + str(count) + " synthetic boxscores in " + out_dir)
+    games = []
+    for fname in sources:
+        rows = load_boxscore_rows(os.path.join(BOXSCORE_DIR, fname))
+        if any(row["Player"] == "LeBron James" and ":" in row["MP"] for row in rows):
+            games.append(rows)
+
+    rng = random.Random(FIXTURE_SEED)
+    os.makedirs(out_dir, exist_ok=True)
+    fnames = []
+    for i in range(count):
+        rows = rng.choice(games)
+        fname = os.path.join(out_dir, "%07d.csv" % i)
+        with open(fname, "w", newline="\n") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            for row in rows:
+                row = dict(row)
+                if ":" in row["MP"] and build_data.is_player_row(row):
+                    seconds = max(60, build_data.parse_minutes(row["MP"]) + rng.randint(-30, 30))
+                    row["MP"] = build_data.format_minutes(seconds)
+                    for stat in ["AST", "DRB", "STL"]:
+                        row[stat] = str(max(0, int(row[stat]) + rng.randint(-1, 1)))
+                writer.writerow(row)
+        fnames.append(fname)
+    return fnames
+
+class Stage:
+    """
+    Timings of one stage of the pipeline.
+    """
+    def __init__(self):
+        self.times = []
+        self.peak_kb = 0
+
+    def call(self, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.times.append(time.perf_counter() - start)
+        return result
+
+    def report(self, games):
+        total = sum(self.times)
+        return dict(summarize(self.times), calls=len(self.times), total_s=total,
+                    games_per_s=games / total if total else None, peak_kb=self.peak_kb)
+
+def run_pipeline(fnames, stages):
+    """
+    Runs the whole pipeline over fnames once: load and split every game, sum them up per
+    GAMES_PER_SEASON games like a season, convert and calculate every calc.py term for each
+    "season". The time of each call goes to its stage in stages.
+    """
+    import build_data
+    import calc
+
+    seasons = []
+    for start in range(0, len(fnames), GAMES_PER_SEASON):
+        splits = []
+        for fname in fnames[start:start + GAMES_PER_SEASON]:
+            rows = stages["csv_load"].call(build_data.load_boxscore_rows, fname)
+            splits.append(stages["split_data"].call(build_data.split_data, rows))
+        seasons.append(stages["sum_splits"].call(build_data.sum_splits, splits))
+
+    info = build_data.load_league_info("20090101")
+    for final in seasons:
+        all_stats = {**final["Player"], **final["Opponent"], **final["Team"], **info}
+        all_stats = stages["convert_data"].call(build_data.convert_data, all_stats)
+        for name, term in calc.TERMS.items():
+            stages["calc." + name].call(term, all_stats)
+
+def measure_peaks(fnames, stages):
+    """
+    Runs the pipeline again one stage at a time under tracemalloc, to get the peak memory
+    each stage allocates on top of what's already there. This is kept out of the timed run,
+    tracemalloc slows everything down a lot.
+    """
+    for name, stage in stages.items():
+        original = stage.call
+
+        def traced(func, *args, original=original, stage=stage):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            result = original(func, *args)
+            stage.peak_kb = max(stage.peak_kb, (tracemalloc.get_traced_memory()[1] - base) // 1024)
+            return result
+        stage.call = traced
+
+    tracemalloc.start()
+    try:
+        run_pipeline(fnames, stages)
+    finally:
+        tracemalloc.stop()
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def bench_pipeline(args):
+    import calc
+
+    if args.scale == 1:
+        fnames = [os.path.join(BOXSCORE_DIR, f) for f in sorted(os.listdir(BOXSCORE_DIR))]
+        # split_data() needs LeBron in the game
+        fnames = [f for f in fnames if any(row["Player"] == "LeBron James" and ":" in row["MP"]
+                                           for row in load_boxscore_rows(f))]
+    else:
+        fnames = synthetic_boxscores(args.scale)
+
+    names = ["csv_load", "split_data", "sum_splits", "convert_data"] + ["calc." + t for t in calc.TERMS]
+    stages = {name: Stage() for name in names}
+    start = time.perf_counter()
+    run_pipeline(fnames, stages)
+    wall = time.perf_counter() - start
+
+    memory = {name: Stage() for name in names}
+    measure_peaks(fnames, memory)
+    for name in names:
+        stages[name].peak_kb = memory[name].peak_kb
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "scale": args.scale,
+        "games": len(fnames),
+        "wall_s": wall,
+        "games_per_s": len(fnames) / wall,
+        "stages": {name: stage.report(len(fnames)) for name, stage in stages.items()},
+    }
+
+    for name in names[:4] + ["calc." + metric for metric in ["ORtg", "DRtg", "OffensiveWinShares",
+                                                            "DefensiveWinShares"]]:
+        stage = report["stages"][name]
+        print("%-26s %8d calls  %9.3f ms/call p50  %9.3f p95  %9.3f p99  %10.0f games/s  %7d KB peak" %
+              (name, stage["calls"], stage["p50_ms"], stage["p95_ms"], stage["p99_ms"],
+               stage["games_per_s"], stage["peak_kb"]))
+    print("%d games in %.2f s (%.0f games/s)" % (len(fnames), wall, len(fnames) / wall))
+
+    output = args.output or os.path.join(RESULTS_DIR, "pipeline-scale%d-%s.json" % (args.scale, report["commit"]))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Saved results to " + output)
+    return report
+
+def bench_compare(args):
+    """
+    Prints how each stage changed between two pipeline result files, by mean time per call.
+    """
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print("%s (%s) -> %s (%s)" % (args.old, old["commit"], args.new, new["commit"]))
+    if old["scale"] != new["scale"]:
+        print("Warning: comparing scale " + str(old["scale"]) + " with scale " + str(new["scale"]))
+    for name, stage in new["stages"].items():
+        if name not in old["stages"]:
+            continue
+        before, after = old["stages"][name]["mean_ms"], stage["mean_ms"]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = "  <-- slower" if change > args.threshold else ""
+        print("%-32s %9.4f ms -> %9.4f ms  %+7.1f%%%s" % (name, before, after, change, flag))
+
+
+def league_boxscores(copies, fixture_dir=FIXTURE_DIR):
+    """
+    Makes a synthetic league corpus: copies games on every date of data/boxscores, each a
+    copy of the real game with the players renamed so every copy has its own players.
+    Files are named YYYYMMDD0NNN.csv, and only generated the first time.
+    """
+    out_dir = os.path.join(fixture_dir, "league_" + str(copies))
+    sources = sorted(f for f in os.listdir(BOXSCORE_DIR) if f.endswith(".csv"))
+    if os.path.isdir(out_dir) and len(os.listdir(out_dir)) == len(sources) * copies:
+        return out_dir
+
+    print("Generating " + str(len(sources) * copies) + " synthetic boxscores in " + out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    for fname in sources:
+        with open(os.path.join(BOXSCORE_DIR, fname)) as f:
+            header, *lines = f.read().splitlines()
+        for copy in range(copies):
+            out = [header]
+            for line in lines:
+                player, rest = line.split(",", 1)
+                if player != "Team Totals" and not player.isdigit():
+                    player += " %d" % copy
+                out.append(player + "," + rest)
+            with open(os.path.join(out_dir, "%s0%03d.csv" % (fname[:8], copy)), "w") as f:
+                f.write("\n".join(out) + "\n")
+    return out_dir
+
+def bench_league(args):
+    import numpy as np
+    import partitions
+
+    boxscore_dir = league_boxscores(args.copies)
+    partition_dir = os.path.join(FIXTURE_DIR, "league_%d_partitions" % args.copies)
+    games = len(os.listdir(boxscore_dir))
+
+    start = time.perf_counter()
+    # The fixtures get their own ingest log, so they stay out of the real one in data/cache
+    ingest_log = os.path.join(FIXTURE_DIR, "league_%d_ingest.json" % args.copies)
+    parsed = partitions.build_partitions(boxscore_dir, partition_dir, args.workers, ingest_log)
+    build = time.perf_counter() - start
+    print("Built %d partitions, %d files parsed, in %.1f s (%.0f games/s)" %
+          (len(parsed), sum(parsed.values()), build, sum(parsed.values()) / build))
+
+    start = time.perf_counter()
+    player_seasons = 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _, players, _, _ in partitions.rate_league(workers=args.workers, partition_dir=partition_dir):
+            player_seasons += len(players)
+    rate = time.perf_counter() - start
+    print("Rated %d player seasons of %d games in %.2f s (%.0f games/s)" %
+          (player_seasons, games, rate, games / rate))
+    print("Peak RSS: %d KB (this process), %d KB (largest worker)" %
+          (max_rss_kb(), resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+
+def startup_time(code, runs):
+    """
+    Median wall clock, in ms, of a new interpreter running code.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return 1000 * statistics.median(times)
+
+def bench_startup(args):
+    import cli
+
+    baseline = startup_time("pass", args.runs)
+    print("%-8s %8.1f ms (bare interpreter)" % ("python", baseline))
+    over = []
+    for command, modules in cli.COMMAND_MODULES.items():
+        ms = startup_time("import " + ", ".join(modules), args.runs)
+        budget = cli.STARTUP_BUDGET_MS[command]
+        if ms > budget:
+            over.append(command)
+        print("%-8s %8.1f ms (imports %.1f ms), budget %d ms%s" %
+              (command, ms, ms - baseline, budget, "  <-- over budget" if ms > budget else ""))
+    return 1 if over else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the stats project")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parse = commands.add_parser("parse", help="Boxscore page parsing")
+    parse.add_argument("--games", type=int, default=100, help="Number of pages to parse")
+    parse.set_defaults(func=bench_parse)
+
+    par = commands.add_parser("parallel", help="Serial vs parallel season ratings")
+    par.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    par.set_defaults(func=bench_parallel)
+
+    pipeline = commands.add_parser("pipeline", help="Per stage timings of the pipeline")
+    pipeline.add_argument("--scale", type=int, default=1,
+                          help="1 for the real boxscores, N for N times as many synthetic ones")
+    pipeline.add_argument("--output", default=None, help="Where to save the JSON results")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    compare = commands.add_parser("compare", help="Compare two pipeline result files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=10.0,
+                         help="Flag stages that got slower by more than this many percent")
+    compare.set_defaults(func=bench_compare)
+
+    league_parser = commands.add_parser("league", help="League wide partitioned ratings")
+    league_parser.add_argument("--copies", type=int, default=10, help="Games on every date")
+    league_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    league_parser.set_defaults(func=bench_league)
+
+    startup = commands.add_parser("startup", help="Startup time of the cli.py commands")
+    startup.add_argument("--runs", type=int, default=5, help="Runs of each, the median is used")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    result = args.func(args)
+    # Only startup gives an exit code, the other commands return their report (or nothing)
+    return result if isinstance(result, int) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
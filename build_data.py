@@ -1,6 +1,26 @@
+import collections
 import csv
+import os
+import sys
+
 import calc
+import league
+
+"""
+Loads LeBron's (or anyone's) games from the boxscores and turns them into advanced stats.
+
+The pipeline from a season file to ratings is a chain of generator stages on
+records.StatRecord, starting from season_dates() here and going on in records.py:
+
+    records.rate_totals(records.accumulate(records.split_games(records.load_games(season_dates(fname)))))
+
+The functions here that work on the nested Player/Team/Opponent split dicts
+(load_boxscore_file, split_data, sum_splits, calculate_advanced_stats...) are the dict
+interface, for a single game or for callers that want dicts, and for rating every player
+of a game (split_all_players(), rate_players()).
+"""
 
+BOXSCORE_DIR = "data/boxscores"
 
 STATS = ["MP","FGM","FGA","3PM","3PA","FTM","FTA","ORB","DRB","TRB","AST","STL","BLK","TOV","PF","PTS"]
 
@@ -12,80 +32,95 @@ def find_player(player_list, player = "LeBron James"):
     print(player_list)
     return -1
 
-def split_data(boxscore_data):
+def is_player_row(row):
     """
-    This function will split the data from one CSV file into three parts. The first is the
-    "LeBron" part, that is a dict that stores his stats from a game. The second is the 
-    "Opponent" part that stores the totals for the other team. Last is the sum of his team's
-    stats.
+    Sometimes the "Team Totals" line doesn't save properly and the row is offset by 1, so
+    a row with a number as the player is a totals row as well.
     """
-    # Get Lebron's stats and cut out unneeded ones
-    lebron_tmp = dict(find_player(boxscore_data))
-    lebron = {"Team": lebron_tmp["Team"]}
-    for stat, val in lebron_tmp.items():
-        if stat in STATS:
-            lebron[stat] = val
+    return not (row["Player"].isdigit() or row["Player"] == "Team Totals")
 
-    team_totals = [{}, {}]
+def team_totals(boxscore_data):
+    """
+    Adds up the STATS of every player of both teams in one pass over the rows. Returns
+    [(team 0 as "Team_" totals, as "Opponent_" totals), (same for team 1)].
+    """
+    totals = [dict.fromkeys(STATS, 0), dict.fromkeys(STATS, 0)]
     for player in boxscore_data:
-
-        # Sometimes the "Team Totals" line doesn't save properly and the row is offset by 1,
-        # this will fix that by skipping it.
-        if player["Player"].isdigit() or player["Player"] == "Team Totals":
+        if not is_player_row(player):
             continue
-        team_index = int(player["Team"])
-
-        if player["Team"] == lebron["Team"]:
-            team_prefix = "Team_"
-        else:
-            team_prefix = "Opponent_"
+        team = totals[int(player["Team"])]
 
-        # Add totals
-        for stat, val in player.items():
-            if stat not in STATS:
-                continue
-             
-            stat = team_prefix + stat
-            if stat not in team_totals[team_index]:
-                team_totals[team_index][stat] = 0
+        for stat in STATS:
+            val = player[stat]
+            if isinstance(val, int) or val.isdigit():
+                team[stat] += int(val)
 
-            # Hacky way of adding up opponent's MP
-            if stat == "Opponent_MP" or stat == "Team_MP":
-                min_sum = sum_minutes(team_totals[team_index][stat], val)
-                team_totals[team_index][stat] = min_sum
-            else:
-                if isinstance(val, int) or val.isdigit():
-                    team_totals[team_index][stat] += int(val)
-   
-    # Sum up the minutes
-    lb_team = int(lebron["Team"])
-    other_team = 1 - lb_team
-    return {"Player": lebron, "Opponent": team_totals[other_team], "Team": team_totals[lb_team]}
+    return [({"Team_" + stat: val for stat, val in team.items()},
+             {"Opponent_" + stat: val for stat, val in team.items()}) for team in totals]
 
-def sum_minutes(m1, m2):
+def make_split(player_row, totals):
     """
-    This function is used to sum minutes in the form of "mm:ss", it will 
-    return a string in the format "mm:ss".
+    Builds the split of one player from its row and the totals from team_totals().
     """
-    if m1 == 0:
-        return m2
+    player = {"Team": player_row["Team"]}
+    for stat in STATS:
+        player[stat] = player_row[stat]
 
-    min1 = m1.split(":")
-    min2 = m2.split(":")
+    team = int(player_row["Team"])
+    return {"Player": player, "Opponent": totals[1 - team][1], "Team": totals[team][0]}
 
-    if not min1[0].isdigit() or not min2[0].isdigit():
-        return m1
+def split_data(boxscore_data, player="LeBron James"):
+    """
+    This function will split the data from one CSV file into three parts. The first is the
+    "LeBron" part, that is a dict that stores his stats from a game. The second is the 
+    "Opponent" part that stores the totals for the other team. Last is the sum of his team's
+    stats.
+    """
+    return make_split(find_player(boxscore_data, player), team_totals(boxscore_data))
 
-    minutes = int(min1[0]) + int(min2[0])
-    seconds = int(min1[1]) + int(min2[1])
+def split_all_players(boxscore_data):
+    """
+    Same as split_data(), but for every player in the game at once: the team totals are
+    added up once (one pass) and shared, then one more pass makes the splits, so it's
+    O(rows) instead of a pass per player. Returns a dict of player name -> split. Note the Team/Opponent dicts are shared between teammates, so
+    don't modify them in place.
+    """
+    totals = team_totals(boxscore_data)
+    return {row["Player"]: make_split(row, totals) for row in boxscore_data if is_player_row(row)}
+
+def parse_minutes(val, missing=0):
+    """
+    Converts minutes in the form "mm:ss" to an integer number of seconds, which is how
+    minutes are carried everywhere after loading. Anything else ("Did Not Play", "nan"...)
+    is returned as missing, by default DNPs count as 0 seconds.
+    """
+    mins = val.split(":")
+    if len(mins) != 2 or not mins[0].isdigit() or not mins[1].isdigit():
+        return missing
+    return int(mins[0]) * 60 + int(mins[1])
 
-    minutes += int(seconds / 60)
-    seconds = seconds % 60
+def format_minutes(seconds):
+    """
+    Formats a number of seconds as "mm:ss", only used for output.
+    """
+    return "%d:%02d" % divmod(int(seconds), 60)
 
-    if seconds < 10:
-        seconds = "0" + str(seconds)
-    return str(minutes) + ":" + str(seconds)
 
+def add_split(sum_dict, split):
+    """
+    Adds one dict returned from split_data() into the totals sum_dict, in place.
+    """
+    for split_name, stat_dict in split.items():
+        totals = sum_dict[split_name]
+        for stat, value in stat_dict.items():
+            if stat == "Player":
+                continue
+            if stat not in totals:
+                totals[stat] = 0
+            # Sometimes get nan and stuff
+            if isinstance(value, int) or value.isdigit():
+                totals[stat] += int(value)
+    return sum_dict
 
 def sum_splits(splits, player="LeBron"):
     """
@@ -94,46 +129,60 @@ def sum_splits(splits, player="LeBron"):
     """
     sum_dict = {"Player":{}, "Team": {}, "Opponent": {}}
     for split in splits:
-        for split_name, stat_dict in split.items():
-            for stat, value in stat_dict.items():
-                if stat == "Player":
-                    continue
-                if stat not in sum_dict[split_name]:
-                    sum_dict[split_name][stat] = 0
-                if stat in ["Opponent_MP", "Team_MP", "MP"]:
-                    mp = sum_dict[split_name][stat]
-                    sum_dict[split_name][stat] = sum_minutes(mp, value)
-                else:
-                    # Sometimes get nan and stuff
-                    if isinstance(value, int) or value.isdigit():
-                        sum_dict[split_name][stat] += int(value)
+        add_split(sum_dict, split)
     return sum_dict
 
-def load_boxscore_file(fname):
+def load_boxscore_rows(fname):
+    """
+    Reads the rows of a boxscore CSV, with the minutes converted to seconds.
+    """
     with open(fname) as csvfile:
         reader = csv.DictReader(csvfile)
         players = []
         for row in reader:
+            row["MP"] = parse_minutes(row["MP"])
             players.append(row)
-        return split_data(players)
+        return players
 
-def load_league_info(game_date):
-    # game_date in form yyyymmdd
-    year = game_date[0:4]
+def load_boxscore_file(fname, player="LeBron James"):
+    return split_data(load_boxscore_rows(fname), player)
+
+
+def season_dates(fname):
+    """
+    Yields the dates (yyyymmdd) of the games in a season file that were actually played,
+    the games that were missed have no game number.
+    """
+    with open(fname) as csvfile:
+        for row in csv.DictReader(csvfile, delimiter=','):
+            if row["G"]:
+                yield row["Date"].replace("-", "")
+
+def last(stage):
+    """
+    Runs a stage to the end and returns the last thing it yielded (None if nothing).
+    """
+    items = collections.deque(stage, maxlen=1)
+    return items[0] if items else None
+
+def game_season(game_date):
+    """
+    Returns the season (as an int) a game on game_date (yyyymmdd) belongs to, games in
+    Oct-Dec count towards the next year's season.
+    """
+    year = int(game_date[0:4])
     month = game_date[4:6]
 
     if month in ["10", "11", "12"]:
-        year = int(year) + 1
-    
-    with open('data/League_Data.csv') as csvfile:
-        creader = csv.DictReader(csvfile, delimiter=',')
-        for row in creader:
-            if row["Year"] == str(year):
-                return row
-    return None
+        year += 1
+    return year
+
+def load_league_info(game_date):
+    # game_date in form yyyymmdd
+    return league.league_info(game_season(game_date))
     
 
-def calculate_advanced_stats(split):
+def calculate_advanced_stats(split, teams=None, context=calc.Context):
     """
     This function takes the 4 dicts (Player, Opponent, Team, LeagueInfo) and will calculate the
     advanced statistics for the player, and will merge all 3 dicts into 1.
@@ -147,64 +196,88 @@ def calculate_advanced_stats(split):
     Note: split["Year"] must equal the SEASON the game takes place in, not the year
     the game took place in. For instance, a game in December 2008 should have the 
     season 2009. This corresponds with the data in the data/League_Data.csv file.
+
+    teams is an optional calc.TeamContexts to share the team level terms with the other
+    players of the same team, and context calc.MaskedContext to rate players with no
+    attempts (see rate_players()).
     """
     all_stats = {**split["Player"], **split["Opponent"], **split["Team"], **split["LeagueInfo"]}
     all_stats = convert_data(all_stats)
-    all_stats["OffensiveWinShares"] = calc.OffensiveWinShares(all_stats)
-    all_stats["DefensiveWinShares"]  = calc.DefensiveWinShares(all_stats)
-    all_stats["DRtg"] = calc.DRtg(all_stats)
-    all_stats["ORtg"] = calc.ORtg(all_stats)
+
+    # Evaluate them together so the terms they share are only computed once
+    metrics = ["OffensiveWinShares", "DefensiveWinShares", "DRtg", "ORtg"]
+    all_stats.update(calc.evaluate(all_stats, metrics, teams, context))
     return all_stats
 
-def convert_data(data):
+def rate_players(splits, league_info, teams=None):
     """
-    This function converts the given data to the proper formats from the strings we read in
+    calculate_advanced_stats() of every split in splits (player name -> split, e.g. from
+    split_all_players()), all with the same league_info. The team level terms (Team_Poss,
+    FMwt, Team_Defensive_Rating...) are computed once per team instead of once per player.
+
+    Players who didn't play (no minutes) are left out. Everyone else gets rated however
+    few attempts they had, with calc.MaskedContext: no free throws means no possessions
+    from free throws, and a rating that's undefined for the player is nan.
     """
-    prefixs = ["", "Opponent_", "Team_"]
-    ints_end  = ["FGM","FGA","3PM","3PA","FTM","FTA","ORB","DRB","TRB","AST","STL","BLK","TOV","PF","PTS"]
-    floats_end= ["Team_Pace", "League_Pace", "LPPP", "LPPG"]
-    mps_end = ["MP"]
+    if teams is None:
+        teams = calc.TeamContexts()
+    rated = {}
+    for player, split in splits.items():
+        minutes = split["Player"]["MP"]
+        if isinstance(minutes, str):
+            minutes = parse_minutes(minutes)
+        if minutes:
+            rated[player] = calculate_advanced_stats(dict(split, LeagueInfo=league_info), teams,
+                                                     calc.MaskedContext)
+    return rated
 
-    ints = [p+i for p in prefixs for i in ints_end]
-    floats = [p+f for p in prefixs for f in floats_end]
-    mps = [p+m for p in prefixs for m in mps_end]
-    
+# The keys convert_data() converts, by type
+_PREFIXES = ["", "Opponent_", "Team_"]
+_INT_KEYS = frozenset(p + stat for p in _PREFIXES for stat in STATS if stat != "MP")
+_FLOAT_KEYS = frozenset(p + f for p in _PREFIXES for f in ["Team_Pace", "League_Pace", "LPPP", "LPPG"])
+_MP_KEYS = frozenset(p + "MP" for p in _PREFIXES)
+
+def convert_data(data):
+    """
+    This function converts the given data to the proper formats from the strings we read in.
+    Stats that aren't numbers (the "nan" of a player who didn't play) count as 0, the same
+    as when splits get added up.
+    """
     for key, val in data.items():
-        if key in ints:
-            if isinstance(val, int) or val.isdigit():
-                data[key] = int(val)
-        elif key in floats:
+        if key in _INT_KEYS:
+            if not isinstance(val, int):
+                data[key] = int(val) if val.isdigit() else 0
+        elif key in _FLOAT_KEYS:
             data[key] = float(val)
-        elif key in mps:
-            mins = val.split(":")
-            if mins[0].isdigit():
-                data[key] = int(mins[0])
-            else: # Count DNPs as 0 minutes
-                data[key] = 0
+        elif key in _MP_KEYS:
+            # Minutes stay in seconds, the formulas only ever use them in ratios
+            if not isinstance(val, int):
+                data[key] = parse_minutes(val)
 
     return data
 
 def print_dict(stats):
     for key, val in stats.items():
+        if key in ["MP", "Team_MP", "Opponent_MP"]:
+            val = format_minutes(val)
         print(key + " == " + str(val))
 
-with open('data/seasons/2009.csv') as csvfile:
-    creader = csv.DictReader(csvfile, delimiter=',')
-    data = []
-    for row in creader:
-        """
-        if ((row["Date"][0:4] == "2009" and row["Date"][5:7] in ["10", "11", "12"]) or
-            (row["Date"][0:4] == "2010" and row["Date"][5:7] not in ["10", "11", "12"])):
-        """
-        print("Loading data from: " + row["Date"])
-        date = row["Date"].replace("-", "")
-        box_data = load_boxscore_file("data/boxscores/" + date + ".csv")
-        box_data["Player"]["Date"] = date
-        data.append(box_data)
-    final = sum_splits(data)
-    final["LeagueInfo"] = load_league_info("20090101")
-    stats = calculate_advanced_stats(final)
+if os.environ.get("STATS_INSTRUMENT"):
+    import instrument
+    instrument.enable_from_env(sys.modules[__name__])
+
+if __name__ == "__main__":
+    import records
+
+    def log_dates(dates):
+        for date in dates:
+            print("Loading data from: " + date)
+            yield date
+
+    games = records.split_games(records.load_games(log_dates(season_dates('data/seasons/2009.csv'))))
+    # Only the totals of the whole season get rated, rate_totals() of every total would rate
+    # after every game
+    _, stats = last(records.rate_totals([last(records.accumulate(games))]))
     print_dict(stats)
     print(calc.TotalPossessions(stats))
     print(calc.PointsProduced(stats))
-
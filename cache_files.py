@@ -0,0 +1,33 @@
+import hashlib
+import json
+import os
+
+"""
+The data/cache directory and the helpers the caches in it share (aggregate.py, schema.py,
+ratings_cache.py). Kept apart so those modules don't have to import each other for them.
+"""
+
+CACHE_DIR = "data/cache"
+
+
+def file_hash(fname):
+    with open(fname, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def load_json(fname, default):
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+def save_json(fname, data):
+    """
+    Writes data to a temp file and then replaces fname with it. The temp file is per
+    process, so workers saving the same cache at once can't trip over each other's.
+    """
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    tmp = "%s.%d.tmp" % (fname, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, fname)
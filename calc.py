@@ -1,3 +1,4 @@
+import functools
 import math
 from collections import OrderedDict
 
@@ -5,9 +6,276 @@ from collections import OrderedDict
 Note all naming matches the formuli on this page:
 
 https://www.basketball-reference.com/about/ratings.html
+
+Every formula only uses +, -, *, / and ** on the values in data, so the same functions
+work on plain numbers and on numpy arrays (see batch.py).
+
+Minutes (MP, Team_MP) only ever show up as ratios of each other, so any unit works as long
+as they're the same one. build_data passes them as integer seconds.
 """
 
+# All the formulas below by name, in the order they are defined
+TERMS = OrderedDict()
+
+def term(func):
+    """
+    Registers func as a formula. The function itself is left as it is, so calling a formula
+    on a plain dict costs exactly what it always has. Evaluating several of them at once
+    with shared terms goes through evaluate() instead.
+    """
+    TERMS[func.__name__] = func
+    return func
+
+
+class Context:
+    """
+    Evaluation context for one input record. Every term is computed at most once and then
+    shared with every other formula that needs it, so asking for several metrics of the
+    same record together (e.g. DRtg and DefensiveWinShares) doesn't recompute FMwt,
+    Team_Poss... over and over. Only the terms the metrics need get computed.
+
+        calc.Context(data).evaluate(["DRtg", "DefensiveWinShares"])
+
+    values can be terms that are already known, e.g. the team level terms from TeamContexts.
+    Subclasses can change how a single term is computed by overriding evaluate_term().
+    """
+    def __init__(self, data, values=None):
+        self.data = data
+        self.values = dict(values) if values else {}
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def evaluate_term(self, name, step):
+        """
+        Computes one term, the terms it uses are already in self.values.
+        """
+        return step(self.data, self.values)
+
+    def evaluate(self, metrics):
+        values = self.values
+        steps = term_steps()
+        if type(self).evaluate_term is Context.evaluate_term:
+            data = self.data
+            for name in evaluation_order(tuple(metrics)):
+                if name not in values:
+                    values[name] = steps[name](data, values)
+        else:
+            for name in evaluation_order(tuple(metrics)):
+                if name not in values:
+                    values[name] = self.evaluate_term(name, steps[name])
+        return {metric: values[metric] for metric in metrics}
+
+# Terms that are 0 when the given input is 0, instead of the 0/0 the formula gives
+ZERO_WHEN_NONE = {
+    "FT_Part": "FTA",
+    "FTxPoss": "FTA",
+    "FG_Part": "FGA",
+    "PProd_FG_Part": "FGA",
+}
+
+class MaskedContext(Context):
+    """
+    Context for rating any player, not just ones with a full stat line: like batch.py, a
+    player with no free throw (or field goal) attempts has no possessions from them, and
+    anything else that is undefined (e.g. ORtg with no possessions at all) is nan instead
+    of a ZeroDivisionError.
+    """
+    def evaluate_term(self, name, step):
+        key = ZERO_WHEN_NONE.get(name)
+        if key is not None and self.data[key] == 0:
+            return 0.0
+        try:
+            return step(self.data, self.values)
+        except ZeroDivisionError:
+            return math.nan
+
+def evaluate(data, metrics, teams=None, context=Context):
+    """
+    Evaluates all the named metrics on data, sharing the intermediate terms between them.
+    With teams (a TeamContexts) the team level terms are also shared with every other
+    record of the same team. data is wrapped in context (Context or MaskedContext) unless
+    it already is one. Returns a dict of metric name -> value.
+    """
+    if not isinstance(data, Context):
+        data = context(data, teams.values(data) if teams is not None else None)
+    return data.evaluate(metrics)
+
+
+def is_team_input(key):
+    """
+    True for the inputs that are the same for every player of a team over the same games:
+    the team and opponent totals and the league info.
+    """
+    return key.startswith(("Team_", "Opponent_", "League_")) or key in ("LPPP", "LPPG")
+
+@functools.lru_cache(maxsize=None)
+def team_terms():
+    """
+    The terms that only depend on team inputs (e.g. Team_Poss, FMwt, Team_Defensive_Rating),
+    found from the dependency graph. Their values are the same for every player of a team.
+    """
+    return tuple(name for name in TERMS if all(is_team_input(key) for key in dependencies(name)[1]))
+
+@functools.lru_cache(maxsize=None)
+def team_inputs():
+    """
+    The inputs the team_terms() read.
+    """
+    return tuple(sorted(set().union(*[dependencies(name)[1] for name in team_terms()])))
+
+
+class TeamContexts:
+    """
+    The values of the team_terms() for every distinct set of team inputs. Records of
+    teammates in a game (or over the same games of a season) have the same team inputs, so
+    the team terms are only computed for the first one and every other Context starts out
+    with them:
+
+        teams = calc.TeamContexts()
+        for split in player_splits:
+            calc.evaluate(split, metrics, teams)
+    """
+    def __init__(self):
+        self.contexts = {}
+
+    def values(self, data):
+        key = tuple(data[key] for key in team_inputs())
+        values = self.contexts.get(key)
+        if values is None:
+            graph = dependency_graph()
+            steps = term_steps()
+            values = self.contexts[key] = {}
+            for name in evaluation_order(team_terms()):
+                # A term that raises ZeroDivisionError (or needs one that did) is left out,
+                # a record that needs it raises the error itself
+                if all(sub in values for sub in graph[name][0]):
+                    try:
+                        values[name] = steps[name](data, values)
+                    except ZeroDivisionError:
+                        pass
+        return values
+
+
+@functools.lru_cache(maxsize=None)
+def _term_definitions():
+    """
+    Returns (source lines of this file, {term: its ast.FunctionDef}), from one parse.
+    """
+    import ast
+    import inspect
+
+    source = inspect.getsource(inspect.getmodule(_term_definitions))
+    return source.splitlines(True), {node.name: node for node in ast.parse(source).body
+                                     if isinstance(node, ast.FunctionDef) and node.name in TERMS}
+
+@functools.lru_cache(maxsize=None)
+def term_sources():
+    """
+    Returns {term: its source code}.
+    """
+    lines, definitions = _term_definitions()
+    return {name: "".join(lines[node.lineno - 1:node.end_lineno])
+            for name, node in definitions.items()}
 
+@functools.lru_cache(maxsize=None)
+def term_steps():
+    """
+    Returns {term: step(data, values)}, the formula of every term with each call of another
+    term (FMwt(data)) swapped for a lookup of its value (values["FMwt"]). Context.evaluate()
+    runs these in evaluation_order(), so every term is one call with no dispatch at all.
+    The steps are compiled from this file's own source, so tracebacks point at the formulas.
+    """
+    import ast
+    import copy
+
+    class TermLookups(ast.NodeTransformer):
+        def visit_Call(self, node):
+            self.generic_visit(node)
+            if isinstance(node.func, ast.Name) and node.func.id in TERMS:
+                return ast.copy_location(ast.Subscript(ast.Name("values", ast.Load()),
+                                                       ast.Constant(node.func.id), ast.Load()), node)
+            return node
+
+    _, definitions = _term_definitions()
+    body = []
+    for node in definitions.values():
+        node = TermLookups().visit(copy.deepcopy(node))
+        node.decorator_list = []
+        node.args.args.append(ast.arg("values"))
+        body.append(node)
+    # The module's globals, so a formula sees the same names (math...) either way it runs
+    namespace = dict(globals())
+    exec(compile(ast.fix_missing_locations(ast.Module(body, [])), __file__, "exec"), namespace)
+    return {name: namespace[name] for name in TERMS}
+
+@functools.lru_cache(maxsize=None)
+def evaluation_order(metrics):
+    """
+    The terms evaluating the metrics (a tuple) needs, each one after the terms it uses.
+    """
+    graph = dependency_graph()
+    order = []
+    seen = set()
+
+    def visit(name):
+        if name not in seen:
+            seen.add(name)
+            for sub in sorted(graph[name][0]):
+                visit(sub)
+            order.append(name)
+    for metric in metrics:
+        visit(metric)
+    return tuple(order)
+
+def _direct_dependencies(name):
+    """
+    Reads the source of a formula and returns (terms it calls, input keys it reads).
+    """
+    import ast
+
+    tree = ast.parse(term_sources()[name])
+    terms, inputs = set(), set()
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+                node.func.id in TERMS):
+            terms.add(node.func.id)
+        elif (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and
+                node.value.id == "data" and isinstance(node.slice, ast.Constant)):
+            inputs.add(node.slice.value)
+    return terms, inputs
+
+@functools.lru_cache(maxsize=None)
+def dependency_graph():
+    """
+    Returns the dependency graph of the formulas, {term: (terms, inputs)} where terms is
+    the set of terms it directly calls and inputs is the set of keys it directly reads.
+    """
+    return {name: _direct_dependencies(name) for name in TERMS}
+
+def dependencies(*metrics):
+    """
+    Returns (terms, inputs) that evaluating all the given metrics can touch, including
+    the metrics themselves. For example "DRtg" not in dependencies("ORtg")[0].
+    """
+    graph = dependency_graph()
+    terms, inputs = set(), set()
+    todo = list(metrics)
+    while todo:
+        name = todo.pop()
+        if name in terms:
+            continue
+        terms.add(name)
+        sub_terms, sub_inputs = graph[name]
+        inputs |= sub_inputs
+        todo.extend(sub_terms)
+    return terms, inputs
+
+
+@term
 def ScoringPossessions(data):
     """
     The following need defined for calculation (and the requirements for each func)
@@ -19,6 +287,7 @@ def ScoringPossessions(data):
             ORB_Part(data))
 
 
+@term
 def FG_Part(data):
     """
     The following must be defined for calculation:
@@ -30,6 +299,7 @@ def FG_Part(data):
     return ( data["FGM"] * (1 - 0.5 * ((data["PTS"] - data["FTM"]) /
             (2 * data["FGA"])) * qAST(data)))
 
+@term
 def qAST(data):
     """
     The following must be defined:
@@ -49,6 +319,7 @@ def qAST(data):
                 ((data["Team_FGM"] / data["Team_MP"]) * data["MP"] * 5 - data["FGM"])) *
                 (1 - (data["MP"] / (data["Team_MP"] / 5)))))
 
+@term
 def AST_Part(data):
     """
     The following must be defined:
@@ -63,14 +334,16 @@ def AST_Part(data):
     return (0.5 * (((data["Team_PTS"] - data["Team_FTM"]) - (data["PTS"] - data["FTM"])) /
             (2 * (data["Team_FGA"] - data["FGA"]))) * data["AST"])
 
+@term
 def FT_Part(data):
     """
     The following must be defined:
         - data["FTM"] - Player free throws made
         - data["FTA"] - Player free throws attempted
     """
-    return ((1 - math.pow((1 - (data["FTM"] / data["FTA"])), 2)) * 0.4 * data["FTA"])
+    return ((1 - (1 - (data["FTM"] / data["FTA"])) ** 2) * 0.4 * data["FTA"])
 
+@term
 def Team_Scoring_Poss(data):
     """
     The following must be defined:
@@ -78,17 +351,20 @@ def Team_Scoring_Poss(data):
         - data["Team_FTM"] - Team free throw made
         - data["Team_FTA"] - Team free throw attempted
     """
-    return (data["Team_FGA"] + (1 - (math.pow(1 - (data["Team_FTM"] / data["Team_FTA"]), 2))) *
+    return (data["Team_FGA"] + (1 - ((1 - (data["Team_FTM"] / data["Team_FTA"])) ** 2)) *
             data["Team_FTA"] * 0.4)
 
+@term
 def Team_Poss(data):
     #return (Team_Scoring_Poss(data) + TeamFGxPoss(data) + TeamFTxPoss(data) + data["Team_TOV"])
     # Formula from https://squared2020.com/2017/11/05/defensive-ratings-estimation-vs-counting/:
     return data["Team_FGA"] + 0.44 * data["Team_FTA"] - data["Team_ORB"] + data["Team_TOV"]
 
+@term
 def Opponent_Poss(data):
     return data["Opponent_FGA"] + 0.44 * data["Opponent_FTA"] - data["Opponent_ORB"] + data["Opponent_TOV"]
 
+@term
 def Team_ORB_Weight(data):
     """
     The following must be defined:
@@ -97,6 +373,7 @@ def Team_ORB_Weight(data):
     torbp = Team_ORB_Percent(data)
     return (((1 - torbp) * tpp) / ((1 - torbp) * tpp + torbp * (1 - tpp)))
 
+@term
 def Team_ORB_Percent(data):
     """
     The following must be defined:
@@ -106,6 +383,7 @@ def Team_ORB_Percent(data):
     """
     return (data["Team_ORB"] / (data["Team_ORB"] + (data["Opponent_TRB"] - data["Opponent_ORB"])))
 
+@term
 def Team_Play_Percent(data):
     """
     The following must be defined:
@@ -115,6 +393,7 @@ def Team_Play_Percent(data):
     """
     return (Team_Scoring_Poss(data) / (data["Team_FGA"] + data["Team_FTA"] * 0.4 + data["Team_TOV"]))
 
+@term
 def ORB_Part(data):
     """
     The following must be defined:
@@ -122,6 +401,7 @@ def ORB_Part(data):
     """
     return data["ORB"] * Team_ORB_Weight(data) * Team_Play_Percent(data)
 
+@term
 def FGxPoss(data):
     """
     The following must be defined:
@@ -130,20 +410,24 @@ def FGxPoss(data):
     """
     return ((data["FGA"] - data["FGM"]) * (1 - 1.07 * Team_ORB_Percent(data)))
 
+@term
 def TeamFGxPoss(data):
     return ((data["Team_FGA"] - data["Team_FGM"]) * (1 - 1.07 * Team_ORB_Percent(data)))
 
+@term
 def FTxPoss(data):
     """
     The following must be defined:
         - data["FTA"] -> Player free throw attempted
         - data["FTM"] -> Player free throw made
     """
-    return (math.pow(1 - (data["FTM"] / data["FTA"]), 2) * 0.4 * data["FTA"])
+    return ((1 - (data["FTM"] / data["FTA"])) ** 2 * 0.4 * data["FTA"])
 
+@term
 def TeamFTxPoss(data):
-    return (math.pow(1 - (data["Team_FTM"] / data["Team_FTA"]), 2) * 0.4 * data["Team_FTA"])
+    return ((1 - (data["Team_FTM"] / data["Team_FTA"])) ** 2 * 0.4 * data["Team_FTA"])
 
+@term
 def TotalPossessions(data):
     """
     The following must be defined (this includes _all_ sub function's requirements):
@@ -172,30 +456,36 @@ def TotalPossessions(data):
     """
     return ScoringPossessions(data) + FGxPoss(data) + FTxPoss(data) + data["TOV"]
 
+@term
 def PointsProduced(data):
     return ((PProd_FG_Part(data) + PProd_AST_Part(data) + data["FTM"]) *
             (1 - (data["Team_ORB"] / Team_Scoring_Poss(data)) * Team_ORB_Weight(data) * 
                 Team_Play_Percent(data)) +
             PProd_ORB_Part(data))
 
+@term
 def PProd_FG_Part(data):
     return (2 * (data["FGM"] + 0.5 * data["3PM"]) * (1 - 0.5 * ((data["PTS"] - data["FTM"]) /
             (2 * data["FGA"])) * qAST(data)))
 
+@term
 def PProd_AST_Part(data):
     return (2 * ((data["Team_FGM"] - data["FGM"] + 0.5 * (data["Team_3PM"] - data["3PM"])) /
         (data["Team_FGM"] - data["FGM"])) * 0.5 * (((data["Team_PTS"] - data["Team_FTM"]) -
             (data["PTS"] - data["FTM"])) / (2 * (data["Team_FGA"] - data["FGA"]))) *
         data["AST"])
 
+@term
 def PProd_ORB_Part(data):
     return (data["ORB"] * Team_ORB_Weight(data) * Team_Play_Percent(data) *
             (data["Team_PTS"] / (data["Team_FGM"] + (1 - 
-                math.pow(1 - (data["Team_FTM"] / data["Team_FTA"]), 2)) * 0.4 * data["Team_FTA"])))
+                (1 - (data["Team_FTM"] / data["Team_FTA"])) ** 2) * 0.4 * data["Team_FTA"])))
 
+@term
 def FloorPercentage(data):
     return ScoringPossessions(data) / TotalPossessions(data)
 
+@term
 def MarginalOffensePlayer(data):
     """
     The following must be defined:
@@ -203,6 +493,7 @@ def MarginalOffensePlayer(data):
     """
     return PointsProduced(data) - 0.92 * data["LPPP"] * TotalPossessions(data)
 
+@term
 def MarginalPointsPerWin(data):
     """
     The following must be defined:
@@ -212,63 +503,78 @@ def MarginalPointsPerWin(data):
     """
     return 0.32 * data["LPPG"] * (data["Team_Pace"] / data["League_Pace"])
 
+@term
 def OffensiveWinShares(data):
     return MarginalOffensePlayer(data) / MarginalPointsPerWin(data)
 
+@term
 def ORtg(data):
     return 100 * (PointsProduced(data) / TotalPossessions(data))
 
 """
 DEFENSIVE CALCULATIONS
 """
+@term
 def Stops(data):
     return Stops_Indiv(data) + Stops_Team(data)
 
+@term
 def Stops_Indiv(data):
     return (data["STL"] + data["BLK"] * FMwt(data) * (1 - 1.07 * DOR_Percent(data)) + 
             data["DRB"] * (1 - FMwt(data)))
 
+@term
 def Stops_Team(data):
     x1 = (data["Opponent_FGA"] - data["Opponent_FGM"] - data["Team_BLK"]) / data["Team_MP"]
     x2 = FMwt(data)
     x3 = (1 - 1.07 * DOR_Percent(data))
     x4 = ((data["Opponent_TOV"] - data["Team_STL"]) / data["Team_MP"] ) 
     x5 = 0.4 * (data["PF"] / data["Team_PF"]) * data["Opponent_FTA"]
-    x6 = math.pow(1 - (data["Opponent_FTM"] / data["Opponent_FTA"]), 2)
+    x6 = (1 - (data["Opponent_FTM"] / data["Opponent_FTA"])) ** 2
     return ((x1 * x2 * x3) + x4) * data["MP"]  + (x5 * x6)
 
+@term
 def FMwt(data):
     return ((DFG_Percent(data) * (1 - DOR_Percent(data))) / (DFG_Percent(data) * 
             (1 - DOR_Percent(data)) + (1 - DFG_Percent(data)) * DOR_Percent(data)))
 
+@term
 def DOR_Percent(data):
     return (data["Opponent_ORB"] / (data["Opponent_ORB"] + data["Team_DRB"]))
 
+@term
 def DFG_Percent(data):
     return (data["Opponent_FGM"] / data["Opponent_FGA"])
 
+@term
 def Stop_Percent(data):
     return ((Stops(data) * data["Team_MP"]) / (Team_Poss(data) * data["MP"]))
 
+@term
 def DRtg(data):
     return (Team_Defensive_Rating(data) + 0.2 * (100 * D_Pts_per_ScPoss(data) * 
             (1 - Stop_Percent(data)) - Team_Defensive_Rating(data)))
 
+@term
 def Team_Defensive_Rating(data):
     return 100 * (data["Opponent_PTS"] / Team_Poss(data))
 
+@term
 def D_Pts_per_ScPoss(data):
     return (data["Opponent_PTS"] / (data["Opponent_FGM"] + (1 - 
-        math.pow(1 - (data["Opponent_FTM"] / data["Opponent_FTA"]), 2)) *
+        (1 - (data["Opponent_FTM"] / data["Opponent_FTA"])) ** 2) *
         data["Opponent_FTA"] * 0.4))
 
+@term
 def Marginal_Defense(data):
     return ((data["MP"] / data["Team_MP"]) * Opponent_Poss(data) * (1.08 * data["LPPP"] -
         (DRtg(data) / 100)))
     
+@term
 def Marginal_PPW(data):
     return (0.32 * data["LPPG"] * ((data["Team_Pace"] / data["League_Pace"])))
 
+@term
 def DefensiveWinShares(data):
     return Marginal_Defense(data) / Marginal_PPW(data)
 
@@ -0,0 +1,97 @@
+import argparse
+import sys
+
+"""
+Command line entry point.
+
+    python cli.py fetch [--workers N] [--rate R]     -> downloads the boxscores we don't have yet
+    python cli.py build                              -> builds the boxscore store and the cached totals
+    python cli.py rate [--player P] [--season S ...] [--metrics M ...] [--career]
+                                                     -> prints ratings (from the ratings cache)
+
+Every command imports what it needs when it runs, so e.g. rate never loads requests or
+numpy. How long each command takes to get going is measured by "python bench.py startup"
+against STARTUP_BUDGET_MS.
+"""
+
+# Modules each command imports, what "bench.py startup" times. Keep in sync with the
+# imports in the commands below
+COMMAND_MODULES = {
+    "fetch": ["pull_data", "requests"],
+    "build": ["store", "aggregate"],
+    "rate": ["ratings_cache"],
+}
+
+# Most a command may take to start (a new interpreter and its imports), in milliseconds
+STARTUP_BUDGET_MS = {
+    "fetch": 300,
+    "build": 300,
+    "rate": 120,
+}
+
+
+def fetch(args):
+    import pull_data
+    errors = pull_data.fetch_boxscores(pull_data.read_master(), workers=args.workers, rate=args.rate)
+    return 1 if errors else 0
+
+def build(args):
+    import aggregate
+    import store
+
+    boxscores, parsed = store.build_store()
+    print("Parsed " + str(parsed) + " boxscore files, store has " + str(len(boxscores)) +
+          " games and " + str(len(boxscores.rows)) + " player rows")
+    print("Added " + str(aggregate.update()) + " new games to the season totals")
+    return 0
+
+def rate(args):
+    import aggregate
+    import ratings_cache
+
+    cache = ratings_cache.RatingsCache()
+    season_dates = {season: aggregate.season_games(season)
+                    for season in (args.season or aggregate.list_seasons())}
+    rated = 0
+    for season, dates in season_dates.items():
+        stats = ratings_cache.season_ratings(cache, args.player, season, dates, args.metrics)
+        if stats is None:
+            print(str(season) + ": no games of " + args.player)
+            continue
+        print(str(season) + ": " + ", ".join(metric + " = " + str(stats[metric]) for metric in args.metrics))
+        rated += 1
+    if args.career and rated:
+        stats = ratings_cache.career_ratings(cache, args.player, season_dates, args.metrics)
+        print("Career: " + ", ".join(metric + " = " + str(stats[metric]) for metric in args.metrics))
+    cache.close()
+    if not rated:
+        print("Error: " + args.player + " didn't play in any of the games")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LeBron stats project")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = commands.add_parser("fetch", help="Download missing boxscores")
+    fetch_parser.add_argument("--workers", type=int, default=4)
+    fetch_parser.add_argument("--rate", type=float, default=1.0, help="Most requests per second")
+    fetch_parser.set_defaults(func=fetch)
+
+    build_parser = commands.add_parser("build", help="Build the boxscore store and season totals")
+    build_parser.set_defaults(func=build)
+
+    rate_parser = commands.add_parser("rate", help="Print season (and career) ratings")
+    rate_parser.add_argument("--player", default="LeBron James")
+    rate_parser.add_argument("--season", type=int, action="append",
+                             help="Season to rate (can be repeated), default is every season")
+    rate_parser.add_argument("--metrics", nargs="+", default=["ORtg", "DRtg"])
+    rate_parser.add_argument("--career", action="store_true", help="Also rate the whole career")
+    rate_parser.set_defaults(func=rate)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import atexit
+import importlib
+import os
+import sys
+import time
+
+import calc
+
+"""
+Optional instrumentation of the hot paths: the record pipeline (schema.load_rows,
+records.from_typed_rows, StatRecord.add, records.sum_records and records.rate), the split
+dict functions of build_data (load_boxscore_file, load_boxscore_rows, split_data,
+sum_splits, add_split and calculate_advanced_stats), and every calc.py term.
+
+Nothing is wrapped until enable() is called, it then swaps the module level functions
+(and calc.TERMS, calc.evaluate and the compiled calc.term_steps()) for timed versions, and
+disable() puts the originals back. The formulas and build_data call each other through
+their module globals, so the nested calls get counted too, and when it's off the code runs
+exactly as if this module didn't exist.
+
+For every function it keeps the number of calls, the cumulative time and the input sizes
+(rows, splits, file bytes or number of records), and for every top level metric how many
+times each of its sub-terms actually got evaluated. A formula called on a plain dict
+evaluates every sub-term it calls, calc.evaluate() evaluates each term at most once per
+record (the others are cache hits and aren't counted), and its counts are kept under the
+metrics it was asked for joined with "+", e.g. "ORtg+DRtg".
+
+    with instrument.enabled() as stats:
+        build_data.calculate_advanced_stats(split)
+    instrument.print_report(stats)
+
+or, for a whole run of any script, set STATS_INSTRUMENT=1 and the report gets printed to
+stderr on exit.
+"""
+
+ENV_SWITCH = "STATS_INSTRUMENT"
+
+BUILD_DATA_FUNCTIONS = ["load_boxscore_file", "load_boxscore_rows", "split_data", "sum_splits",
+                        "add_split", "calculate_advanced_stats"]
+
+# (module, function) of the record pipeline, a "Class.method" name wraps the method
+PIPELINE_FUNCTIONS = [("schema", "load_rows"), ("records", "from_typed_rows"),
+                      ("records", "StatRecord.add"), ("records", "sum_records"), ("records", "rate")]
+
+
+def input_size(arg):
+    """
+    Size of the first argument of an instrumented call: bytes for a file name, length for
+    a list of rows/splits, elements for a batch of records and 1 for a single record.
+    """
+    if isinstance(arg, str):
+        try:
+            return os.path.getsize(arg)
+        except OSError:
+            return 0
+    if isinstance(arg, list):
+        return len(arg)
+    if isinstance(arg, dict):
+        # The data of a term step, numpy columns when it's a batch
+        return max([getattr(val, "size", 1) for val in arg.values()] or [1])
+    size = getattr(arg, "size", None)
+    if callable(size):
+        # batch.BatchRecord gives the shape of its columns
+        count = 1
+        for n in size():
+            count *= n
+        return count
+    return 1
+
+
+class FunctionStats:
+    __slots__ = ["calls", "seconds", "total_size", "max_size"]
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.total_size = 0
+        self.max_size = 0
+
+    def as_dict(self):
+        return {"calls": self.calls, "seconds": self.seconds, "total_size": self.total_size,
+                "max_size": self.max_size}
+
+
+class Stats:
+    """
+    Everything recorded while instrumentation is on. functions maps a name
+    ("build_data.split_data", "calc.DRtg"...) to its FunctionStats, and term_calls maps each
+    top level metric (or "+" joined metrics of a calc.evaluate()) to {sub-term: evaluations}.
+    Single threaded, like the pipeline.
+    """
+    def __init__(self):
+        self.functions = {}
+        self.term_calls = {}
+        self._stack = []
+
+    def function(self, name):
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats()
+        return stats
+
+    def report(self):
+        return {"functions": {name: stats.as_dict() for name, stats in self.functions.items()},
+                "term_calls": self.term_calls}
+
+
+def wrap(stats, name, func, term_name=None):
+    function_stats = stats.function(name)
+
+    def wrapper(*args, **kwargs):
+        function_stats.calls += 1
+        if args:
+            size = input_size(args[0])
+            function_stats.total_size += size
+            if size > function_stats.max_size:
+                function_stats.max_size = size
+
+        if term_name is not None:
+            stack = stats._stack
+            if stack:
+                counts = stats.term_calls[stack[0]]
+                counts[term_name] = counts.get(term_name, 0) + 1
+            else:
+                stats.term_calls.setdefault(term_name, {})
+            stack.append(term_name)
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            function_stats.seconds += time.perf_counter() - start
+            if term_name is not None:
+                stats._stack.pop()
+
+    wrapper.__wrapped__ = func
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+def wrap_evaluate(stats, func):
+    """
+    wrap() for calc.evaluate(): the term steps it runs get counted under its metrics.
+    """
+    timed = wrap(stats, "calc.evaluate", func)
+
+    def wrapper(data, metrics, *args, **kwargs):
+        key = "+".join(metrics)
+        if not stats._stack:
+            stats.term_calls.setdefault(key, {})
+        stats._stack.append(key)
+        try:
+            return timed(data, metrics, *args, **kwargs)
+        finally:
+            stats._stack.pop()
+
+    wrapper.__wrapped__ = func
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+# The Stats being recorded into and the functions that got swapped out, while enabled
+_stats = None
+_originals = []
+
+
+def enable(stats=None, build_data=None):
+    """
+    Starts recording into stats (a new Stats by default) and returns it. Calling it again
+    while enabled just returns the current Stats. build_data is the module to instrument,
+    it's only needed when build_data.py is the script being run (__main__).
+    """
+    global _stats
+    if _stats is not None:
+        return _stats
+    _stats = stats if stats is not None else Stats()
+    if build_data is None:
+        import build_data
+
+    for name in BUILD_DATA_FUNCTIONS:
+        func = getattr(build_data, name)
+        _originals.append((build_data, name, func))
+        setattr(build_data, name, wrap(_stats, "build_data." + name, func))
+
+    for module_name, name in PIPELINE_FUNCTIONS:
+        owner = importlib.import_module(module_name)
+        class_name, _, attr = name.rpartition(".")
+        if class_name:
+            owner = getattr(owner, class_name)
+        func = getattr(owner, attr)
+        _originals.append((owner, attr, func))
+        setattr(owner, attr, wrap(_stats, module_name + "." + name, func))
+
+    for name, func in list(calc.TERMS.items()):
+        wrapped = wrap(_stats, "calc." + name, func, term_name=name)
+        _originals.append((calc, name, func))
+        setattr(calc, name, wrapped)
+        calc.TERMS[name] = wrapped
+
+    # What calc.evaluate() runs instead of the formulas, one call per term evaluated
+    steps = calc.term_steps()
+    for name, step in list(steps.items()):
+        _originals.append((steps, name, step))
+        steps[name] = wrap(_stats, "calc." + name, step, term_name=name)
+    _originals.append((calc, "evaluate", calc.evaluate))
+    calc.evaluate = wrap_evaluate(_stats, calc.evaluate)
+    return _stats
+
+def disable():
+    """
+    Puts the original functions back, returns the Stats that was recorded into.
+    """
+    global _stats
+    for target, name, func in reversed(_originals):
+        if isinstance(target, dict):
+            target[name] = func
+            continue
+        setattr(target, name, func)
+        if target is calc and name in calc.TERMS:
+            calc.TERMS[name] = func
+    del _originals[:]
+    stats, _stats = _stats, None
+    return stats
+
+class enabled:
+    """
+    Context manager version of enable()/disable(), gives the Stats.
+    """
+    def __init__(self, stats=None):
+        self.stats = stats
+
+    def __enter__(self):
+        return enable(self.stats)
+
+    def __exit__(self, *exc):
+        disable()
+        return False
+
+
+def print_report(stats, out=sys.stdout):
+    print("%-40s %10s %12s %14s %10s" % ("function", "calls", "total ms", "avg size", "max size"),
+          file=out)
+    for name, func in sorted(stats.functions.items(), key=lambda item: -item[1].seconds):
+        if not func.calls:
+            continue
+        print("%-40s %10d %12.3f %14.1f %10d" % (name, func.calls, 1000 * func.seconds,
+                                                 func.total_size / func.calls, func.max_size),
+              file=out)
+
+    for metric, counts in sorted(stats.term_calls.items()):
+        if counts:
+            print(metric + ": " + ", ".join(term + " x" + str(n) for term, n in
+                                             sorted(counts.items(), key=lambda item: -item[1])),
+                  file=out)
+
+def enable_from_env(build_data=None):
+    """
+    Turns instrumentation on for the whole process if STATS_INSTRUMENT is set, and prints
+    the report to stderr on exit. build_data.py calls this when it gets imported.
+    """
+    if os.environ.get(ENV_SWITCH) and _stats is None:
+        stats = enable(build_data=build_data)
+        atexit.register(print_report, stats, sys.stderr)
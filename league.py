@@ -0,0 +1,79 @@
+import csv
+import os
+
+"""
+League info (data/League_Data.csv) lookups.
+
+The file is read once per process into a {season: info} table with the numbers already
+converted to floats, and read again only if the file changes. There's also a vectorized
+version for the batch evaluators, that maps a whole array of game dates to their seasons
+and league info columns at once.
+"""
+
+LEAGUE_DATA = "data/League_Data.csv"
+FLOAT_FIELDS = ["Team_Pace", "League_Pace", "LPPP", "LPPG"]
+
+# fname -> ((mtime, size) of the file when it was read, table)
+_tables = {}
+
+
+def read_league_table(fname):
+    table = {}
+    with open(fname) as csvfile:
+        for row in csv.DictReader(csvfile, delimiter=','):
+            row["Year"] = int(row["Year"])
+            for field in FLOAT_FIELDS:
+                row[field] = float(row[field])
+            table[row["Year"]] = row
+    return table
+
+def league_table(fname=LEAGUE_DATA):
+    """
+    Returns {season: league info} for every season in fname. The table is shared by the
+    whole process, so don't modify it.
+    """
+    stat = os.stat(fname)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _tables.get(fname)
+    if cached is None or cached[0] != version:
+        cached = (version, read_league_table(fname))
+        _tables[fname] = cached
+    return cached[1]
+
+def league_info(season, fname=LEAGUE_DATA):
+    """
+    Returns a copy of the league info of a season (int), or None if we don't have it.
+    """
+    info = league_table(fname).get(season)
+    return None if info is None else dict(info)
+
+
+def date_seasons(dates):
+    """
+    Vectorized build_data.game_season(), dates is an array (or list) of yyyymmdd as ints
+    or strings. Returns an int array of seasons.
+    """
+    import numpy as np
+
+    dates = np.asarray(dates).astype(np.int64)
+    return dates // 10000 + ((dates // 100) % 100 >= 10)
+
+def league_columns(dates, fname=LEAGUE_DATA):
+    """
+    Returns the FLOAT_FIELDS of the season of every date as column arrays, ready to be
+    merged into the columns given to batch.evaluate(). Seasons we have no info for are nan.
+    """
+    import numpy as np
+
+    table = league_table(fname)
+    seasons = date_seasons(dates)
+    first = min(table)
+    lookup = np.full((max(table) - first + 1, len(FLOAT_FIELDS)), np.nan)
+    for season, info in table.items():
+        lookup[season - first] = [info[field] for field in FLOAT_FIELDS]
+
+    known = (seasons >= first) & (seasons - first < len(lookup))
+    values = np.full((len(seasons), len(FLOAT_FIELDS)), np.nan)
+    values[known] = lookup[seasons[known] - first]
+    return {field: values[:, i] for i, field in enumerate(FLOAT_FIELDS)}
@@ -0,0 +1,102 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import build_data
+import league
+import store
+
+"""
+Computes season ratings for one or more players on every core.
+
+Each (player, season) is independent: pick the player's games of that season out of the
+boxscore store, sum them into one split and run calculate_advanced_stats() on it. The work
+is spread over a process pool, where each worker memory-maps the store and reads
+League_Data.csv once when it starts, so tasks only carry (player, season) and nothing big
+gets pickled. Results always come back in the same (player, season) order no matter which
+worker finished first.
+
+    python parallel.py ["Player Name" ...]
+"""
+
+# Set in every worker by init_worker()
+_store = None
+_league = None
+
+
+def init_worker(store_dir, league_data):
+    global _store, _league
+    _store = store.load_store(store_dir)
+    _league = league.league_table(league_data)
+
+def season_rows(boxscores, player, season, dates=None):
+    """
+    Returns the rows of the games player played in during season. If dates (yyyymmdd) is
+    given only those games are used, e.g. to match a season file.
+    """
+    row_idx = boxscores.player_rows(player)
+    rows = boxscores.rows[row_idx]
+    keep = (boxscores.game_seasons()[rows["game"]] == season) & (rows["MP"] > 0)
+    if dates is not None:
+        game_dates = boxscores.games["date"][rows["game"]]
+        keep &= np.isin(game_dates, np.array([int(d) for d in dates]))
+    return row_idx[keep]
+
+def rate_season(task):
+    """
+    Runs in a worker, task is (player, season, dates or None).
+    """
+    player, season, dates = task
+    split = _store.player_split(season_rows(_store, player, season, dates))
+    split["LeagueInfo"] = dict(_league[season])
+    return build_data.calculate_advanced_stats(split)
+
+def player_seasons(boxscores, player, league_table):
+    """
+    The seasons a player has played in, that we have league info for.
+    """
+    rows = boxscores.rows[boxscores.player_rows(player)]
+    seasons = np.unique(boxscores.game_seasons()[rows["game"][rows["MP"] > 0]])
+    return [int(season) for season in seasons if int(season) in league_table]
+
+def rate_seasons(players, seasons=None, season_dates=None, workers=None,
+                 store_dir=store.STORE_DIR, league_data=league.LEAGUE_DATA):
+    """
+    Computes the advanced stats of every season of every player in players. seasons limits
+    the seasons (default is every season the player played in), and season_dates can map a
+    season to the list of dates to use for it. Seasons the player has no games in (among
+    the dates, if given) or no league info for are left out. The store is built first if
+    there isn't one yet. Returns {(player, season): stats}, ordered by player then season.
+    """
+    boxscores = store.load_store(store_dir)
+    if boxscores is None:
+        boxscores, _ = store.build_store(store_dir=store_dir)
+    league_table = league.league_table(league_data)
+    season_dates = season_dates or {}
+
+    tasks = []
+    for player in players:
+        played = player_seasons(boxscores, player, league_table)
+        for season in ([s for s in seasons if s in played] if seasons else played):
+            dates = season_dates.get(season)
+            if dates is None or len(season_rows(boxscores, player, season, dates)):
+                tasks.append((player, season, dates))
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(store_dir, league_data)) as executor:
+        # A few chunks per worker keeps them all busy without a round trip per task
+        chunksize = max(1, len(tasks) // (4 * workers))
+        results = executor.map(rate_season, tasks, chunksize=chunksize)
+        return {(player, season): stats for (player, season, _), stats in zip(tasks, results)}
+
+
+if __name__ == "__main__":
+    import sys
+
+    store.build_store()
+    players = sys.argv[1:] or ["LeBron James"]
+    for (player, season), stats in rate_seasons(players).items():
+        print(player + " " + str(season) + ": ORtg = " + str(stats["ORtg"]) + ", DRtg = " +
+              str(stats["DRtg"]))
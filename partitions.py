@@ -0,0 +1,195 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import batch
+import build_data
+import calc
+import league
+import schema
+import store
+
+"""
+League wide season ratings for every player, out of core.
+
+The boxscores are stored partitioned by season: every season is its own columnar store
+(see store.py) under data/store/seasons/<season>/, built and refreshed independently, so
+a new game only touches its own season and no step ever needs more than one season in
+memory. Rating a season goes through its rows in chunks of CHUNK_ROWS, adding every
+player's game stats (with the team/opponent totals of each game) into per player season
+totals, and then rates all the players of the season at once with batch.evaluate().
+Seasons are spread over a process pool, so memory stays at about one season's team
+totals plus one chunk per worker however many seasons there are.
+
+League_Data.csv only has the pace of LeBron's team, so the Team_Pace of every player (used
+by the win shares) is estimated from the team and opponent possessions of the games they
+played in instead, see team_pace(). That's a per player pace rather than a per team one
+(a traded player gets the pace of both teams, weighted by games), and its possession
+estimate isn't quite the one behind League_Pace, so the win shares of other teams are
+approximate.
+
+    python partitions.py [--workers N] [--output FILE]
+"""
+
+PARTITION_DIR = os.path.join(store.STORE_DIR, "seasons")
+OUTPUT = os.path.join(store.STORE_DIR, "league_ratings.csv")
+
+METRICS = batch.OUTPUTS
+
+# Rows handled at once when adding up a season, ~100 bytes of columns per row
+CHUNK_ROWS = 1 << 16
+
+
+def season_files(boxscore_dir=store.BOXSCORE_DIR):
+    """
+    Returns {season: [boxscore file names]}.
+    """
+    seasons = {}
+    for fname in sorted(os.listdir(boxscore_dir)):
+        if fname.endswith(".csv"):
+            seasons.setdefault(build_data.game_season(fname[:8]), []).append(fname)
+    return seasons
+
+def partition_path(season, partition_dir=PARTITION_DIR):
+    return os.path.join(partition_dir, str(season))
+
+def build_partition(task):
+    """
+    Runs in a worker, task is (season, fnames, boxscore_dir, partition_dir, ingest_log).
+    Returns the number of files (re)parsed and the ingest log entries the worker validated,
+    for the parent to save.
+    """
+    season, fnames, boxscore_dir, partition_dir, ingest_log = task
+    ingest = schema.IngestLog(ingest_log)
+    _, parsed = store.build_store(boxscore_dir, partition_path(season, partition_dir), fnames,
+                                  ingest)
+    return parsed, ingest.validated
+
+def build_partitions(boxscore_dir=store.BOXSCORE_DIR, partition_dir=PARTITION_DIR, workers=None,
+                     ingest_log=schema.INGEST_LOG):
+    """
+    Builds (or refreshes) the store of every season, in parallel. The workers' ingest
+    entries are saved once, here, to ingest_log. Returns {season: number of files
+    (re)parsed}.
+    """
+    seasons = season_files(boxscore_dir)
+    tasks = [(season, fnames, boxscore_dir, partition_dir, ingest_log)
+             for season, fnames in seasons.items()]
+    ingest = schema.IngestLog(ingest_log)
+    parsed = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for season, (count, validated) in zip(seasons, executor.map(build_partition, tasks)):
+            parsed[season] = count
+            ingest.merge(validated)
+    ingest.save()
+    return parsed
+
+def list_partitions(partition_dir=PARTITION_DIR):
+    if not os.path.isdir(partition_dir):
+        return []
+    return sorted(int(name) for name in os.listdir(partition_dir) if name.isdigit())
+
+
+def season_totals(boxscores, chunk_rows=CHUNK_ROWS):
+    """
+    Adds up the games of every player who played in a season store. Returns (games played
+    per player, {column: per player totals}) with one element per entry of boxscores.players,
+    columns named like store.BoxscoreStore.player_columns().
+    """
+    n = len(boxscores.players)
+    games = np.zeros(n, dtype=np.int64)
+    totals = {}
+    for start in range(0, len(boxscores.rows), chunk_rows):
+        row_idx = np.arange(start, min(start + chunk_rows, len(boxscores.rows)))
+        row_idx = row_idx[boxscores.rows["MP"][row_idx] > 0]
+        players = boxscores.rows["player"][row_idx]
+        games += np.bincount(players, minlength=n)
+        for key, column in boxscores.player_columns(row_idx).items():
+            column_sum = np.bincount(players, weights=column, minlength=n)
+            if key in totals:
+                totals[key] += column_sum
+            else:
+                totals[key] = column_sum
+    return games, totals
+
+def team_pace(columns):
+    """
+    Possessions per 48 minutes of the games in the season totals columns (arrays, minutes
+    in seconds), averaging the team and opponent possessions.
+    """
+    possessions = (calc.Team_Poss(columns) + calc.Opponent_Poss(columns)) / 2
+    return 48 * 60 * possessions / (columns["Team_MP"] / 5)
+
+def rate_partition(task):
+    """
+    Runs in a worker, task is (season, partition_dir, metrics, chunk_rows). Returns
+    (season, players, games, {metric: array}) for the players who played, or None if the
+    season has no store or no league info.
+    """
+    season, partition_dir, metrics, chunk_rows = task
+    boxscores = store.load_store(partition_path(season, partition_dir))
+    info = league.league_info(season)
+    if boxscores is None or info is None:
+        return None
+
+    games, totals = season_totals(boxscores, chunk_rows)
+    played = np.flatnonzero(games)
+    columns = {key: column[played] for key, column in totals.items()}
+    columns.update({field: info[field] for field in league.FLOAT_FIELDS})
+    columns["Team_Pace"] = team_pace(columns)
+    ratings = batch.evaluate(columns, metrics)
+    return season, [boxscores.players[i] for i in played], games[played], ratings
+
+def rate_league(seasons=None, workers=None, metrics=METRICS, partition_dir=PARTITION_DIR,
+                chunk_rows=CHUNK_ROWS):
+    """
+    Rates every player of every season (default: every partition). Yields (season, players,
+    games, {metric: array}) in season order, as the seasons finish.
+    """
+    seasons = seasons or list_partitions(partition_dir)
+    tasks = [(season, partition_dir, metrics, chunk_rows) for season in seasons]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for result in executor.map(rate_partition, tasks):
+            if result is not None:
+                yield result
+
+def write_ratings(results, fname=OUTPUT, metrics=METRICS):
+    """
+    Writes the results of rate_league() to a CSV, one line per player and season, as they
+    come in. Returns the number of lines.
+    """
+    os.makedirs(os.path.dirname(fname) or ".", exist_ok=True)
+    lines = 0
+    with open(fname + ".tmp", "w", newline="\n") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Season", "Player", "G"] + metrics)
+        for season, players, games, ratings in results:
+            for i, player in enumerate(players):
+                writer.writerow([season, player, int(games[i])] +
+                                ["%.4f" % ratings[metric][i] for metric in metrics])
+                lines += 1
+    os.replace(fname + ".tmp", fname)
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="League wide season ratings")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=OUTPUT)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    parsed = build_partitions(workers=args.workers)
+    print("Built " + str(len(parsed)) + " season partitions (" + str(sum(parsed.values())) +
+          " files parsed) in %.1f s" % (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lines = write_ratings(rate_league(workers=args.workers), args.output)
+    print("Rated " + str(lines) + " player seasons in %.1f s, saved to %s" %
+          (time.perf_counter() - start, args.output))
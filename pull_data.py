@@ -1,12 +1,141 @@
-import requests
 import csv
-import pandas as pd
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+# requests is only imported by the functions that download something, so parsing/saving
+# pages (and importing this module) doesn't pay for it
+BASE_URL = "https://www.basketball-reference.com/boxscores/"
+BOXSCORE_DIR = "data/boxscores"
+MANIFEST = "data/boxscore_manifest.json"
 
 INPUT_FIELDS = ["Starters","MP","FG","FGA","FG%","3P","3PA","3P%","FT","FTA","FT%","ORB", 
                 "DRB","TRB","AST","STL","BLK","TOV","PF","PTS","+/-"]
 OUTPUT_FIELDS = ["Player","MP","FGM","FGA","FG%","3PM","3PA","3P%","FTM","FTA","FT%","ORB", 
                 "DRB","TRB","AST","STL","BLK","TOV","PF","PTS","+/-", "Team"]
 
+# Maps the column names on the page to the ones we save
+FIELD_NAMES = dict(zip(INPUT_FIELDS, OUTPUT_FIELDS))
+
+# The ids of the basic box score tables, e.g. "box-CLE-game-basic" (or "box_cle_basic" on
+# older pages)
+BASIC_TABLE_ID = re.compile(r"(-game-basic|_basic)$")
+BASIC_TABLE = re.compile(r'<table[^>]*\sid="[^"]*(-game-basic|_basic)"')
+
+# Status codes worth trying again after a little wait
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+class BoxscoreTableParser(HTMLParser):
+    """
+    Streaming parser that only picks out the basic box score table of each team (the
+    tables with an id like "box-CLE-game-basic") and turns their rows straight into dicts
+    keyed by OUTPUT_FIELDS, everything else fed to it is skipped. Once both tables are
+    read, done is set and the rest of the page doesn't need to be fed in.
+
+    Rows come out the same way the pandas version of the scraper saved them: empty cells
+    are "nan", a "Did Not Play" style row has the reason as its MP and "nan" for the rest,
+    and the totals row has "Team Totals" as the player.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.teams = []
+        self.done = False
+        self.table = None
+        self.columns = None
+        self.row = None
+        self.cell = None
+        self.skip_row = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.table is None:
+            if tag == "table":
+                table_id = dict(attrs).get("id") or ""
+                if BASIC_TABLE_ID.search(table_id):
+                    self.table = []
+                    self.columns = None
+            return
+
+        if tag == "tr":
+            self.row = []
+            self.skip_row = "thead" in (dict(attrs).get("class") or "")
+        elif tag in ("td", "th") and self.row is not None:
+            colspan = dict(attrs).get("colspan") or "1"
+            self.cell = [int(colspan) if colspan.isdigit() else 1]
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+    def handle_endtag(self, tag):
+        if self.table is None:
+            return
+
+        if tag in ("td", "th") and self.cell is not None:
+            text = "".join(self.cell[1:]).strip()
+            self.row.append(text if text else "nan")
+            # A "Did Not Play" cell spans the rest of the row
+            self.row.extend(["nan"] * (self.cell[0] - 1))
+            self.cell = None
+        elif tag == "tr" and self.row is not None:
+            self.end_row(self.row)
+            self.row = None
+        elif tag == "table":
+            self.teams.append(self.table)
+            self.table = None
+            self.done = len(self.teams) == 2
+
+    def end_row(self, row):
+        if self.columns is None:
+            # The header row is the one that starts with "Starters", skip the one above it
+            if row and row[0] == "Starters":
+                self.columns = [FIELD_NAMES.get(name) for name in row]
+            return
+        if self.skip_row or not row or row[0] == "Starters":
+            return
+
+        player = {}
+        for field, val in zip(self.columns, row):
+            if field is not None:
+                player[field] = val
+        if player["Player"] == "nan":
+            player["Player"] = "Team Totals"
+        self.table.append(player)
+
+def parse_boxscore_html(html):
+    """
+    Returns the [team1, team2] player lists of a boxscore page, like save_boxscore() wants.
+    Only the two basic tables are fed to the parser, the rest of the page is never tokenized.
+    """
+    parser = BoxscoreTableParser()
+    for match in BASIC_TABLE.finditer(html):
+        end = html.find("</table>", match.start())
+        if end == -1:
+            end = len(html)
+        parser.feed(html[match.start():end + len("</table>")])
+        if parser.done:
+            break
+    parser.close()
+
+    if len(parser.teams) != 2:
+        raise ValueError("Expected 2 basic box score tables, found " + str(len(parser.teams)))
+    return parser.teams
+
+def read_html_tables(html):
+    """
+    The old way of parsing a page: have pandas read every table on it and keep tables 0
+    and 2. It's a lot slower than parse_boxscore_html(), it's kept around to compare.
+    """
+    import pandas as pd
+
+    tables = pd.read_html(io.StringIO(html))
+    return [parse_team_table(tables[0]), parse_team_table(tables[2])]
+
 def parse_team_table(table):
     """
     This horrendous function parses one of the tables on the bball ref page, and will put all the stats 
@@ -14,7 +143,7 @@ def parse_team_table(table):
     to "Player".
     """
     player_list = []
-    for i in table.iteritems():
+    for i in table.items():
         index = 0
         column_name = i[0][1]
         if column_name in INPUT_FIELDS:
@@ -29,25 +158,35 @@ def parse_team_table(table):
    
     return player_list
 
-def get_boxscore(date, home_team):
+def boxscore_url(date, home_team, base_url=BASE_URL):
+    return base_url + date + "0" + home_team + ".html"
+
+def get_boxscore(date, home_team, session=None, base_url=BASE_URL, out_dir=BOXSCORE_DIR):
     """
+    Downloads the boxscore of the game on date (yyyymmdd) played at home_team, and saves
+    it to out_dir. Returns the path it was saved to.
     """
-    url = "https://www.basketball-reference.com/boxscores/" + date + "0" + home_team + ".html"
-    r = requests.get(url)
-    tables = pd.read_html(r.text)
-    
-    team1 = parse_team_table(tables[0])
-    team2 = parse_team_table(tables[2])
-    save_boxscore(date, [ team1, team2 ])
+    if session is None:
+        import requests as session
+    r = session.get(boxscore_url(date, home_team, base_url))
+    r.raise_for_status()
+    return parse_and_save(date, r.text, out_dir)
+
+def parse_and_save(date, html, out_dir=BOXSCORE_DIR):
+    return save_boxscore(date, parse_boxscore_html(html), out_dir)
 
 
-def save_boxscore(date, team_data):
+def save_boxscore(date, team_data, out_dir=BOXSCORE_DIR):
     """
     Saves the boxscore, differentiating the players by a simple field "Team" that will be 
     0/1. Note this is pretty hacky for my need, since I don't really care which team the 
     player is on, only if they are on LeBron's or not.
+
+    The file is written to a temp file first, so an interrupted run never leaves a half
+    written boxscore behind.
     """
-    with open('data/boxscores/' + date + '.csv', 'w', newline='\n') as csvfile:
+    fname = os.path.join(out_dir, date + '.csv')
+    with open(fname + '.tmp', 'w', newline='\n') as csvfile:
         writer = csv.DictWriter(csvfile, delimiter=',', fieldnames=OUTPUT_FIELDS)
         writer.writeheader()
 
@@ -59,18 +198,154 @@ def save_boxscore(date, team_data):
                 if i["Player"] == "":
                     i["Player"] = "Team Totals"
                 writer.writerow(i)
+    os.replace(fname + '.tmp', fname)
+    return fname
 
-"""
-Go through the master list of LeBron's games, and get each boxscore and save it
-"""
-with open('data/seasons/master.csv') as csvfile:
-    reader = csv.DictReader(csvfile)
+def read_master(fname='data/seasons/master.csv'):
+    """
+    Go through the master list of LeBron's games, and return (date, home team) for each
+    """
+    games = []
+    with open(fname) as csvfile:
+        reader = csv.DictReader(csvfile)
 
-    for row in reader:
-        new_date = row["Date"].replace('-', '')
-        if row["Loc"] == "@":
-            home_team = row["Opp"]
+        for row in reader:
+            new_date = row["Date"].replace('-', '')
+            if row["Loc"] == "@":
+                home_team = row["Opp"]
+            else:
+                home_team = row["Tm"]
+            games.append((new_date, home_team))
+    return games
+
+
+def file_checksum(fname):
+    with open(fname, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class Manifest:
+    """
+    Keeps track of the boxscores that were downloaded, and the sha256 of the file that was
+    saved for each. It's written after every game so that a rerun picks up where the last
+    one stopped.
+    """
+    def __init__(self, fname=MANIFEST):
+        self.fname = fname
+        self.lock = threading.Lock()
+        try:
+            with open(fname) as f:
+                self.checksums = json.load(f)
+        except FileNotFoundError:
+            self.checksums = {}
+
+    def is_present(self, date, out_dir=BOXSCORE_DIR):
+        """
+        A boxscore is present if its file exists and, when we have a checksum for it, the
+        file still matches it. Files from before there was a manifest are trusted.
+        """
+        fname = os.path.join(out_dir, date + '.csv')
+        if not os.path.exists(fname):
+            return False
+        checksum = self.checksums.get(date)
+        return checksum is None or checksum == file_checksum(fname)
+
+    def add(self, date, fname):
+        checksum = file_checksum(fname)
+        with self.lock:
+            self.checksums[date] = checksum
+            with open(self.fname + '.tmp', 'w') as f:
+                json.dump(self.checksums, f, indent=1, sort_keys=True)
+            os.replace(self.fname + '.tmp', self.fname)
+
+class RateLimiter:
+    """
+    Spaces out requests so that there is at least 1 / rate seconds between the start of
+    any two of them, no matter which thread makes them.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def fetch(session, url, limiter, retries=4, backoff=2.0):
+    """
+    GETs url, retrying connection errors and RETRY_STATUS responses with an exponential
+    backoff (or the Retry-After the server asked for). Raises the last error when out of
+    retries.
+    """
+    import requests
+
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            r = session.get(url, timeout=30)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+
+        if r.status_code not in RETRY_STATUS or attempt == retries:
+            r.raise_for_status()
+            return r.text
+
+        retry_after = r.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            time.sleep(int(retry_after))
         else:
-            home_team = row["Tm"]
+            time.sleep(backoff * 2 ** attempt)
+
+def make_session(workers):
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_boxscores(games, workers=4, rate=1.0, base_url=BASE_URL, out_dir=BOXSCORE_DIR,
+                    manifest=None, retries=4, backoff=2.0):
+    """
+    Downloads the boxscore of every (date, home team) in games that we don't already have,
+    using up to workers connections at once but never more than rate requests per second.
+    Returns a dict of date -> error for the games that failed, those are simply fetched
+    again on the next run.
+    """
+    if manifest is None:
+        manifest = Manifest()
+    missing = [(date, home) for date, home in games if not manifest.is_present(date, out_dir)]
+    print("Fetching " + str(len(missing)) + " of " + str(len(games)) + " boxscores")
+
+    session = make_session(workers)
+    limiter = RateLimiter(rate)
+
+    def fetch_one(game):
+        date, home_team = game
+        html = fetch(session, boxscore_url(date, home_team, base_url), limiter, retries, backoff)
+        manifest.add(date, parse_and_save(date, html, out_dir))
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_one, game): game[0] for game in missing}
+        for future, date in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print("Error: couldn't fetch " + date + ": " + str(e))
+                errors[date] = e
+    session.close()
+    return errors
+
 
-        get_boxscore(new_date, home_team)
+if __name__ == "__main__":
+    fetch_boxscores(read_master())
@@ -0,0 +1,170 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+
+import aggregate
+import build_data
+import cache_files
+import calc
+import league
+import records
+
+"""
+On disk cache of computed ratings (an SQLite file, data/cache/ratings.sqlite).
+
+Every rating is stored under (player, scope, key, metric), where scope is "game", "season"
+or "career" and key is the date, the season or "career". Along with the value go two
+hashes that say whether it's still good:
+
+    inputs  -> sha256 of the boxscore files it was computed from and of the League_Data row
+    formula -> sha256 of the source of the metric and every term it depends on in calc.py
+
+The hash of each boxscore file is kept too, with the file's mtime and size, so files that
+haven't been touched aren't read again just to hash them.
+
+So a re-downloaded boxscore only invalidates the ratings that include that game, and a
+change to e.g. a DRtg sub-term only invalidates DRtg and the metrics built on it. Anything
+stale or missing is computed again (only the metrics that need it) and stored.
+
+    python ratings_cache.py ["Player Name"]
+"""
+
+CACHE_FILE = os.path.join(cache_files.CACHE_DIR, "ratings.sqlite")
+
+METRICS = records.METRICS
+
+
+@functools.lru_cache(maxsize=None)
+def formula_version(metric):
+    """
+    Hash of the source of metric and all the terms it depends on.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(calc.dependencies(metric)[0]):
+        digest.update(name.encode())
+        digest.update(calc.term_sources()[name].encode())
+    return digest.hexdigest()
+
+class RatingsCache:
+    def __init__(self, fname=CACHE_FILE):
+        if os.path.dirname(fname):
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+        self.db = sqlite3.connect(fname)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS ratings (
+                               player TEXT, scope TEXT, key TEXT, metric TEXT,
+                               inputs TEXT, formula TEXT, value REAL,
+                               PRIMARY KEY (player, scope, key, metric))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+                               fname TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, hash TEXT)""")
+        self.file_hashes = {fname: (mtime, size, digest) for fname, mtime, size, digest in
+                            self.db.execute("SELECT fname, mtime, size, hash FROM files")}
+
+    def file_hash(self, fname):
+        """
+        cache_files.file_hash() of fname, only read again if its mtime or size changed.
+        """
+        stat = os.stat(fname)
+        cached = self.file_hashes.get(fname)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        digest = cache_files.file_hash(fname)
+        self.file_hashes[fname] = (stat.st_mtime_ns, stat.st_size, digest)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                            (fname, stat.st_mtime_ns, stat.st_size, digest))
+        return digest
+
+    def inputs_hash(self, fnames, league_info):
+        """
+        Hash of the content of the boxscore files (in order) and the league info.
+        """
+        digest = hashlib.sha256()
+        for fname in fnames:
+            digest.update(self.file_hash(fname).encode())
+        digest.update(json.dumps(league_info, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, player, scope, key, inputs, metrics):
+        """
+        Returns {metric: value} of the metrics that are cached with these inputs and the
+        current formula, the others are left out.
+        """
+        cursor = self.db.execute("SELECT metric, inputs, formula, value FROM ratings "
+                                 "WHERE player = ? AND scope = ? AND key = ?",
+                                 (player, scope, str(key)))
+        found = {}
+        for metric, cached_inputs, formula, value in cursor:
+            if metric in metrics and cached_inputs == inputs and formula == formula_version(metric):
+                found[metric] = value
+        return found
+
+    def put(self, player, scope, key, inputs, ratings):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                [(player, scope, str(key), metric, inputs, formula_version(metric),
+                                  float(value)) for metric, value in ratings.items()])
+
+    def close(self):
+        self.db.close()
+
+
+def cached_ratings(cache, player, scope, key, dates, league_info, metrics=METRICS,
+                   boxscore_dir=build_data.BOXSCORE_DIR):
+    """
+    Ratings of player over the games on dates, with league_info. Only what isn't in the
+    cache (or is stale) gets loaded and computed. Returns {metric: value}, or None if player
+    didn't play in any of the games.
+    """
+    fnames = [os.path.join(boxscore_dir, date + ".csv") for date in dates]
+    inputs = cache.inputs_hash(fnames, league_info)
+    ratings = cache.get(player, scope, key, inputs, metrics)
+    missing = [metric for metric in metrics if metric not in ratings]
+    if missing:
+        games = [record for _, record in
+                 records.split_games(records.load_games(dates, boxscore_dir), player)]
+        if not games:
+            return None
+        total = records.sum_records(games).with_league(league_info)
+        computed = records.rate(total, missing)
+        cache.put(player, scope, key, inputs, computed)
+        ratings.update(computed)
+    return {metric: ratings[metric] for metric in metrics}
+
+def game_ratings(cache, player, date, metrics=METRICS):
+    return cached_ratings(cache, player, "game", date, [date],
+                          build_data.load_league_info(date), metrics)
+
+def season_ratings(cache, player, season, dates, metrics=METRICS):
+    return cached_ratings(cache, player, "season", season, dates,
+                          league.league_info(season), metrics)
+
+def career_ratings(cache, player, season_dates, metrics=METRICS):
+    """
+    season_dates maps every season to its dates. The league info is the one of the last
+    season, like the career to date ratings in rolling.py.
+    """
+    dates = [date for season in sorted(season_dates) for date in season_dates[season]]
+    return cached_ratings(cache, player, "career", "career", dates,
+                          league.league_info(max(season_dates)), metrics)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    player = sys.argv[1] if len(sys.argv) > 1 else "LeBron James"
+    start = time.perf_counter()
+    cache = RatingsCache()
+    season_dates = {season: aggregate.season_games(season) for season in aggregate.list_seasons()}
+    for season, dates in season_dates.items():
+        stats = season_ratings(cache, player, season, dates)
+        if stats is not None:
+            print(str(season) + ": ORtg = " + str(stats["ORtg"]) + ", DRtg = " + str(stats["DRtg"]))
+    stats = career_ratings(cache, player, season_dates)
+    if stats is None:
+        sys.exit("No games of " + player)
+    print("Career: ORtg = " + str(stats["ORtg"]) + ", DRtg = " + str(stats["DRtg"]))
+    print("%.1f ms" % (1000 * (time.perf_counter() - start)))
@@ -0,0 +1,236 @@
+import os
+
+import build_data
+import calc
+import league
+import schema
+
+"""
+Fixed layout stat records, and the pipeline from season file to ratings built on them.
+
+A split used to be three nested dicts whose keys got built by string concatenation for
+every game ("Team_" + stat...), that calculate_advanced_stats() then merged with the league
+info, converting every value again. A StatRecord is a single flat list of numbers instead,
+with every input of the formulas at a fixed offset (FIELDS), so building and summing games
+is a couple of list operations and no keys get made at all.
+
+The pipeline is a chain of generator stages, each one taking the iterator of the one
+before it, so only one game is ever in memory however many seasons go through:
+
+    build_data.season_dates() -> dates of the games played, from a season file (or any live feed of dates)
+    load_games()              -> (date, typed rows of the boxscore), clean files take schema.py's fast path
+    split_games()             -> (date, StatRecord of the player)
+    accumulate()              -> (date, running total StatRecord)
+    rate_totals()             -> (date, advanced stats of the totals so far)
+
+The calc.py formulas accept a StatRecord directly (it has the same data["FGM"] interface
+as the dict). Dicts only show up at the edges: from_split()/from_rows() for the nested
+splits and rows of build_data's dict functions, and as_dict() for output.
+
+    record = records.from_rows(build_data.load_boxscore_rows(fname))
+    ratings = records.rate(record.with_league(league.league_info(2009)))
+"""
+
+STATS = build_data.STATS
+N = len(STATS)
+
+FIELDS = (STATS + ["Team_" + stat for stat in STATS] + ["Opponent_" + stat for stat in STATS] +
+          league.FLOAT_FIELDS)
+INDEX = {key: i for i, key in enumerate(FIELDS)}
+
+# Offsets of each part of a record
+PLAYER = slice(0, N)
+TEAM = slice(N, 2 * N)
+OPPONENT = slice(2 * N, 3 * N)
+LEAGUE = slice(3 * N, len(FIELDS))
+
+METRICS = ["OffensiveWinShares", "DefensiveWinShares", "DRtg", "ORtg"]
+
+
+def stat_value(val):
+    # Sometimes get nan and stuff
+    if isinstance(val, int) or val.isdigit():
+        return int(val)
+    return 0
+
+
+class StatRecord:
+    """
+    Player, Team, Opponent and league stats of one game (or a sum of games) as one list,
+    indexed by name through INDEX.
+    """
+    __slots__ = ["values"]
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else [0] * len(FIELDS)
+
+    def __getitem__(self, key):
+        return self.values[INDEX[key]]
+
+    def __setitem__(self, key, val):
+        self.values[INDEX[key]] = val
+
+    def __contains__(self, key):
+        return key in INDEX
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return "StatRecord(" + repr(self.as_dict()) + ")"
+
+    def keys(self):
+        return FIELDS
+
+    def get(self, key, default=None):
+        i = INDEX.get(key)
+        return default if i is None else self.values[i]
+
+    def add(self, other):
+        """
+        Adds the player/team/opponent stats of other to this record in place, the league
+        info is left alone.
+        """
+        values = self.values
+        for i, val in enumerate(other.values[:LEAGUE.start]):
+            values[i] += val
+        return self
+
+    def with_league(self, info):
+        """
+        Returns a copy with the league info (a dict with the league.FLOAT_FIELDS) filled in.
+        """
+        values = self.values[:LEAGUE.start]
+        values.extend(float(info[field]) for field in league.FLOAT_FIELDS)
+        return StatRecord(values)
+
+    def as_dict(self):
+        return dict(zip(FIELDS, self.values))
+
+
+def from_rows(boxscore_data, player="LeBron James"):
+    """
+    Builds the record of player from the rows of one boxscore, like split_data() does.
+    Returns None if player isn't in the game.
+    """
+    totals = [[0] * N, [0] * N]
+    player_row = None
+    for row in boxscore_data:
+        if not build_data.is_player_row(row):
+            continue
+        team = totals[int(row["Team"])]
+        team[0] += row["MP"] if isinstance(row["MP"], int) else stat_value(row["MP"])
+        for i in range(1, N):
+            val = row[STATS[i]]
+            if val.isdigit():
+                team[i] += int(val)
+        if row["Player"] == player:
+            player_row = row
+
+    if player_row is None:
+        return None
+    team = int(player_row["Team"])
+    values = [stat_value(player_row[stat]) for stat in STATS]
+    values.extend(totals[team])
+    values.extend(totals[1 - team])
+    values.extend([0.0] * (LEAGUE.stop - LEAGUE.start))
+    return StatRecord(values)
+
+def from_split(split):
+    """
+    Dict adapter: builds a record from a split (the nested dicts of split_data() or
+    sum_splits(), with or without "LeagueInfo") or from a flat dict of the same keys.
+    """
+    if "Player" in split and isinstance(split["Player"], dict):
+        flat = {**split["Player"], **split["Opponent"], **split["Team"], **split.get("LeagueInfo", {})}
+    else:
+        flat = split
+    values = [stat_value(flat.get(key, 0)) for key in FIELDS[:LEAGUE.start]]
+    values.extend(float(flat.get(key, 0.0)) for key in league.FLOAT_FIELDS)
+    return StatRecord(values)
+
+def from_typed_rows(rows, player="LeBron James"):
+    """
+    from_rows() of the typed rows of schema.load_rows(), [(player, team, values in STATS
+    order)], nothing left to parse. Returns None if player isn't in the game.
+    """
+    totals = [[0] * N, [0] * N]
+    player_row = None
+    for name, team, values in rows:
+        team_totals = totals[team]
+        for i, val in enumerate(values):
+            team_totals[i] += val
+        if name == player:
+            player_row = (team, values)
+
+    if player_row is None:
+        return None
+    team, values = player_row
+    values = values + totals[team] + totals[1 - team]
+    values.extend([0.0] * (LEAGUE.stop - LEAGUE.start))
+    return StatRecord(values)
+
+
+def sum_records(records):
+    """
+    Sums records up like sum_splits(), the league info of the result is empty.
+    """
+    total = StatRecord()
+    for record in records:
+        total.add(record)
+    return total
+
+def rate(record, metrics=METRICS, teams=None):
+    """
+    Evaluates metrics on a record (with its league info filled in), returns {metric: value}.
+    teams is an optional calc.TeamContexts shared by the records of a team.
+    """
+    return calc.evaluate(record, metrics, teams)
+
+
+def load_games(dates, boxscore_dir=build_data.BOXSCORE_DIR, ingest=None):
+    """
+    Yields (date, typed rows) for every date in dates, ingest is the schema.IngestLog that
+    says which files take the fast path (the one in data/cache by default, saved at the end).
+    """
+    if ingest is None:
+        ingest = schema.IngestLog()
+    for date in dates:
+        yield date, schema.load_rows(os.path.join(boxscore_dir, date + ".csv"), ingest)
+    ingest.save()
+
+def split_games(games, player="LeBron James"):
+    """
+    Yields (date, record of player) for every (date, rows) in games that player played in.
+    """
+    for date, rows in games:
+        record = from_typed_rows(rows, player)
+        if record is not None:
+            yield date, record
+
+def accumulate(games, per_season=False):
+    """
+    Yields (date, total of every record so far) for every (date, record) in games. The same
+    total is updated in place and yielded every time, copy it to keep one around. With
+    per_season the total starts over at the first game of every season.
+    """
+    total = StatRecord()
+    season = None
+    for date, record in games:
+        if per_season and build_data.game_season(date) != season:
+            season = build_data.game_season(date)
+            total = StatRecord()
+        total.add(record)
+        yield date, total
+
+def rate_totals(totals, metrics=METRICS):
+    """
+    Yields (date, stats) for every (date, total) in totals, where stats is the total with the
+    league info of the season of date as a flat dict, along with the metrics, like
+    calculate_advanced_stats() gives.
+    """
+    for date, total in totals:
+        record = total.with_league(build_data.load_league_info(date))
+        stats = record.as_dict()
+        stats.update(rate(record, metrics))
+        yield date, stats
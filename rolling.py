@@ -0,0 +1,123 @@
+import collections
+
+import numpy as np
+
+import batch
+import store
+
+"""
+Rolling window and cumulative (career to date) ratings.
+
+Every rating is a function of the summed counting stats of the games it covers, so the
+per game stats of a player are turned into prefix sums once, after which the totals of any
+window are P[end] - P[start]. That makes every window position O(1) no matter how long the
+window is, and all of them are rated in one batch.evaluate() call with the calc.py formulas.
+
+For games that come in one at a time there's RollingRatings, which keeps the running sums
+of the last N games and of the whole career and rates both on every new game.
+
+    python rolling.py [window] ["Player Name"]
+"""
+
+METRICS = ["ORtg", "DRtg", "OffensiveWinShares", "DefensiveWinShares"]
+
+
+def player_game_columns(boxscores, player):
+    """
+    Returns (dates, columns) of every game player played in (MP > 0), in date order, with
+    one element per game in each column.
+    """
+    row_idx = boxscores.player_rows(player)
+    row_idx = row_idx[boxscores.rows["MP"][row_idx] > 0]
+    dates = boxscores.games["date"][boxscores.rows["game"][row_idx]]
+    return dates, boxscores.player_columns(row_idx)
+
+def prefix_sums(columns):
+    """
+    P[i] = sum of the first i games, for every column.
+    """
+    return {key: np.concatenate([[0], np.cumsum(column)]) for key, column in columns.items()}
+
+def window_sums(prefix, window):
+    """
+    Totals of every window of window consecutive games, element i covers games i .. i+window-1.
+    """
+    return {key: p[window:] - p[:-window] for key, p in prefix.items()}
+
+def cumulative_sums(prefix):
+    """
+    Totals of every game up to and including game i.
+    """
+    return {key: p[1:] for key, p in prefix.items()}
+
+def rate_sums(sums, dates, metrics=METRICS):
+    """
+    Rates summed columns, using the league info of the season of dates (one per element,
+    usually the date of the last game in the window).
+    """
+    return batch.evaluate(sums, metrics, dates=dates)
+
+def rolling_ratings(dates, columns, window, metrics=METRICS):
+    """
+    Ratings of every window of window games. Returns (end dates, {metric: array}), the
+    ratings of a window are listed under the date of its last game.
+    """
+    if window < 1:
+        raise ValueError("window must be at least 1 game, got " + str(window))
+    if len(dates) < window:
+        return dates[:0], {metric: np.zeros(0) for metric in metrics}
+    end_dates = dates[window - 1:]
+    return end_dates, rate_sums(window_sums(prefix_sums(columns), window), end_dates, metrics)
+
+def cumulative_ratings(dates, columns, metrics=METRICS):
+    """
+    Career to date ratings after every game, returns (dates, {metric: array}).
+    """
+    return dates, rate_sums(cumulative_sums(prefix_sums(columns)), dates, metrics)
+
+
+class RollingRatings:
+    """
+    Streaming version for games that come in one at a time: push() the columns of one game
+    (a dict of numbers, like one element of player_game_columns()) and get back the ratings
+    of the last window games and of every game so far. Each push is O(1).
+    """
+    def __init__(self, window, metrics=METRICS):
+        if window < 1:
+            raise ValueError("window must be at least 1 game, got " + str(window))
+        self.window = window
+        self.metrics = metrics
+        self.games = collections.deque()
+        self.window_totals = collections.Counter()
+        self.totals = collections.Counter()
+
+    def push(self, date, game):
+        self.games.append(game)
+        self.window_totals.update(game)
+        self.totals.update(game)
+        if len(self.games) > self.window:
+            self.window_totals.subtract(self.games.popleft())
+
+        ratings = {"Date": date, "Career": self.rate(date, self.totals), "Window": None}
+        if len(self.games) == self.window:
+            ratings["Window"] = self.rate(date, self.window_totals)
+        return ratings
+
+    def rate(self, date, totals):
+        columns = {key: np.array([val]) for key, val in totals.items()}
+        return {metric: float(val[0]) for metric, val in
+                rate_sums(columns, np.array([date]), self.metrics).items()}
+
+
+if __name__ == "__main__":
+    import sys
+
+    window = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    player = sys.argv[2] if len(sys.argv) > 2 else "LeBron James"
+
+    boxscores, _ = store.build_store()
+    dates, columns = player_game_columns(boxscores, player)
+    end_dates, ratings = rolling_ratings(dates, columns, window)
+    for i, date in enumerate(end_dates):
+        print(str(date) + ": " + ", ".join(metric + " = " + "%.2f" % ratings[metric][i]
+                                           for metric in METRICS))
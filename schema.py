@@ -0,0 +1,203 @@
+import csv
+import os
+
+import build_data
+import cache_files
+
+"""
+Boxscore CSV schema, checked once per file at ingest.
+
+Every file is validated against the layout pull_data.py writes and classified as "clean"
+or "repair", and the result (with the problems found) is recorded in
+data/cache/ingest.json along with the mtime and size of the file, so it's only checked
+again if the file changes.
+
+The quirks every file has are part of the schema and don't count as problems: the second
+"Team Totals" row is saved offset by one column (a number in the Player column), rows of
+players who didn't play have the reason in MP and nan for the stats, and the percentage
+and +/- columns can be nan. What makes a file need repair is anything else, e.g. a player
+who played with a blank or nan counting stat, stats with no minutes, a bad MP or Team, or
+a different header.
+
+Clean files are then parsed with no checks at all (straight int() of every stat), files
+that need repair go through the careful parser that treats anything unreadable as 0,
+like split_data()/sum_splits() always have. Either way the rows that come out are typed,
+every value an int, so turning them into records (records.from_typed_rows()) and adding
+those up needs no checks either. store.py uses the same status to parse clean files
+without checks.
+
+    python schema.py       -> validates new/changed files and lists the ones that need repair
+"""
+
+HEADER = ["Player","MP","FGM","FGA","FG%","3PM","3PA","3P%","FTM","FTA","FT%","ORB","DRB","TRB",
+          "AST","STL","BLK","TOV","PF","PTS","+/-","Team"]
+
+# Counting stats, in build_data.STATS order (MP is parsed separately)
+COUNT_STATS = build_data.STATS[1:]
+
+# Column of each field in a file with the HEADER, for the fast path
+PLAYER_COLUMN, MP_COLUMN, TEAM_COLUMN = HEADER.index("Player"), HEADER.index("MP"), HEADER.index("Team")
+COUNT_COLUMNS = [HEADER.index(stat) for stat in COUNT_STATS]
+
+INGEST_LOG = os.path.join(cache_files.CACHE_DIR, "ingest.json")
+INGEST_VERSION = 1
+
+CLEAN = "clean"
+REPAIR = "repair"
+
+
+def is_totals_row(row):
+    return row["Player"] == "Team Totals" or row["Player"].isdigit()
+
+def played(mp):
+    mins, _, secs = mp.partition(":")
+    return mins.isdigit() and secs.isdigit()
+
+def validate_rows(header, rows):
+    """
+    Returns the list of problems (strings) found in the rows of one boxscore, empty if it's
+    clean.
+    """
+    if header != HEADER:
+        return ["header is " + ",".join(header or [])]
+
+    issues = []
+    teams = set()
+    for line, row in enumerate(rows, 2):
+        if is_totals_row(row):
+            continue
+        if row["Team"] not in ("0", "1"):
+            issues.append("line %d: Team is %r" % (line, row["Team"]))
+            continue
+        teams.add(row["Team"])
+        if not row["Player"]:
+            issues.append("line %d: no player name" % line)
+        if not played(row["MP"]):
+            if ":" in row["MP"] or row["MP"].isdigit():
+                issues.append("line %d: MP is %r" % (line, row["MP"]))
+            elif any(row[stat].isdigit() for stat in COUNT_STATS):
+                issues.append("line %d: %s has stats but MP is %r" % (line, row["Player"], row["MP"]))
+            continue
+        bad = [stat for stat in COUNT_STATS if not row[stat].isdigit()]
+        if bad:
+            issues.append("line %d: %s of %s is not a number" % (line, ",".join(bad), row["Player"]))
+    if teams != {"0", "1"}:
+        issues.append("missing the players of a team")
+    return issues
+
+def validate_file(fname):
+    with open(fname) as csvfile:
+        reader = csv.DictReader(csvfile)
+        return validate_rows(reader.fieldnames, reader)
+
+
+def parse_clean(lines):
+    """
+    Fast path: [(player, team, [MP seconds] + COUNT_STATS)] of a clean file, no checks.
+    lines are the csv.reader() lists of the file after the header, since the header has been
+    checked every column is where HEADER says it is.
+    """
+    parsed = []
+    for line in lines:
+        player = line[PLAYER_COLUMN]
+        if player == "Team Totals" or player.isdigit():
+            continue
+        mp = line[MP_COLUMN]
+        if ":" in mp:
+            mins, secs = mp.split(":")
+            values = [int(mins) * 60 + int(secs)]
+            values.extend(int(line[i]) for i in COUNT_COLUMNS)
+        else:
+            values = [0] * len(build_data.STATS)
+        parsed.append((player, int(line[TEAM_COLUMN]), values))
+    return parsed
+
+def parse_repair(rows):
+    """
+    Careful path for files that need repair, anything that isn't a number counts as 0.
+    """
+    parsed = []
+    for row in rows:
+        if is_totals_row(row) or row["Team"] not in ("0", "1"):
+            continue
+        values = [build_data.parse_minutes(row["MP"])]
+        values.extend(int(row[stat]) if row[stat].isdigit() else 0 for stat in COUNT_STATS)
+        parsed.append((row["Player"], int(row["Team"]), values))
+    return parsed
+
+
+class IngestLog:
+    """
+    The recorded classification of every boxscore file, {fname: {"mtime", "size", "status",
+    "issues"}}.
+    """
+    def __init__(self, fname=INGEST_LOG):
+        self.fname = fname
+        data = cache_files.load_json(fname, {})
+        self.files = data.get("files", {}) if data.get("version") == INGEST_VERSION else {}
+        # The entries validated by this process, see merge()
+        self.validated = {}
+        self.dirty = False
+
+    def status(self, fname):
+        """
+        Returns CLEAN or REPAIR for a file, validating it first if it's new or changed.
+        """
+        stat = os.stat(fname)
+        entry = self.files.get(fname)
+        if entry is None or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            issues = validate_file(fname)
+            entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size,
+                     "status": REPAIR if issues else CLEAN, "issues": issues}
+            self.files[fname] = entry
+            self.validated[fname] = entry
+            self.dirty = True
+        return entry["status"]
+
+    def merge(self, validated):
+        """
+        Adds the validated entries of another IngestLog (e.g. one in a worker process), so
+        that a single log saves the work of all of them. Logs that save the same file
+        separately overwrite each other's entries.
+        """
+        if validated:
+            self.files.update(validated)
+            self.validated.update(validated)
+            self.dirty = True
+
+    def needs_repair(self):
+        return {fname: entry["issues"] for fname, entry in sorted(self.files.items())
+                if entry["status"] == REPAIR}
+
+    def save(self):
+        if self.dirty:
+            cache_files.save_json(self.fname, {"version": INGEST_VERSION, "files": self.files})
+            self.dirty = False
+
+
+def load_rows(fname, log):
+    """
+    Typed rows of a boxscore, [(player, team, values in build_data.STATS order)].
+    """
+    clean = log.status(fname) == CLEAN
+    with open(fname) as csvfile:
+        if clean:
+            lines = csv.reader(csvfile)
+            next(lines)
+            return parse_clean(lines)
+        return parse_repair(csv.DictReader(csvfile))
+
+
+if __name__ == "__main__":
+    log = IngestLog()
+    fnames = sorted(os.path.join(build_data.BOXSCORE_DIR, f)
+                    for f in os.listdir(build_data.BOXSCORE_DIR) if f.endswith(".csv"))
+    statuses = [log.status(fname) for fname in fnames]
+    log.save()
+
+    repair = log.needs_repair()
+    print(str(statuses.count(CLEAN)) + " clean files, " + str(len(repair)) + " need repair")
+    for fname, issues in repair.items():
+        print(fname + ":")
+        for issue in issues:
+            print("    " + issue)
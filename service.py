@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import collections
+import json
+import math
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import batch
+import calc
+import league
+import rolling
+import store
+
+"""
+Local HTTP service for ratings on demand.
+
+The boxscore store and League_Data.csv are loaded once when the service starts and kept
+in memory, along with the prefix sums of the games of every player that gets asked about
+(see rolling.py), so the totals of any date range are one subtraction. Queries that come
+in at about the same time are rated together in one batch.evaluate() call.
+
+    python service.py [--host 127.0.0.1] [--port 8765]
+
+    GET  /ratings?player=LeBron James&start=20090101&end=20090430&metrics=ORtg,DRtg
+    POST /ratings      body: [{"player": ..., "start": ..., "end": ..., "metrics": [...]}, ...]
+    GET  /metrics      -> request counts, latency percentiles and batch sizes
+
+start and end (yyyymmdd) are inclusive and both optional. The league info is the one of
+the season of the last game in the range. Ratings that can't be computed (no games) are null.
+A POST answers with one entry per query, either its ratings or {"error": ...} for a query
+that's invalid or names an unknown player.
+"""
+
+DEFAULT_METRICS = ["ORtg", "DRtg"]
+
+# How long the batcher waits for more queries after the first one, and the most it takes
+BATCH_WINDOW = 0.002
+MAX_BATCH = 256
+
+# Latencies kept per endpoint for the percentiles
+LATENCY_SAMPLES = 10000
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error"}
+
+
+class QueryError(Exception):
+    pass
+
+
+class Ratings:
+    """
+    The warm state: the store, and the dates and prefix sums of every player seen so far.
+    """
+    def __init__(self, boxscores):
+        self.boxscores = boxscores
+        self.players = {}
+        league.league_table()
+
+    def player(self, name):
+        cached = self.players.get(name)
+        if cached is None:
+            if self.boxscores.player_id(name) == -1:
+                raise QueryError("Unknown player: " + name)
+            dates, columns = rolling.player_game_columns(self.boxscores, name)
+            cached = self.players[name] = (dates, rolling.prefix_sums(columns))
+        return cached
+
+    def rate(self, queries):
+        """
+        Rates a list of queries (dicts with player, start, end, metrics) in one batch.
+        Returns one {metric: value} per query.
+        """
+        ranges = []
+        for query in queries:
+            dates, prefix = self.player(query["player"])
+            first = np.searchsorted(dates, query["start"], side="left")
+            last = np.searchsorted(dates, query["end"], side="right")
+            ranges.append((prefix, first, last, dates[last - 1] if last > first else query["end"]))
+
+        keys = ranges[0][0].keys()
+        columns = {key: np.array([prefix[key][last] - prefix[key][first]
+                                  for prefix, first, last, _ in ranges]) for key in keys}
+        end_dates = np.array([end for _, _, _, end in ranges])
+        metrics = sorted(set(metric for query in queries for metric in query["metrics"]))
+        results = batch.evaluate(columns, metrics, dates=end_dates)
+
+        empty = [last == first for _, first, last, _ in ranges]
+        return [{metric: None if empty[i] or not math.isfinite(results[metric][i])
+                 else float(results[metric][i]) for metric in query["metrics"]}
+                for i, query in enumerate(queries)]
+
+
+def parse_query(params):
+    """
+    Checks a query (from the url or the POST body) and fills in the defaults.
+    """
+    if not isinstance(params, dict):
+        raise QueryError("A query must be an object")
+    if not params.get("player") or not isinstance(params["player"], str):
+        raise QueryError("A query needs a player")
+    metrics = params.get("metrics") or DEFAULT_METRICS
+    if isinstance(metrics, str):
+        metrics = metrics.split(",")
+    if not isinstance(metrics, list):
+        raise QueryError("metrics must be a list of names")
+    for metric in metrics:
+        if not isinstance(metric, str) or metric not in calc.TERMS:
+            raise QueryError("Unknown metric: " + json.dumps(metric))
+    try:
+        start = int(params.get("start") or 0)
+        end = int(params.get("end") or 99999999)
+    except (TypeError, ValueError):
+        raise QueryError("start and end must be yyyymmdd")
+    return {"player": params["player"], "start": start, "end": end, "metrics": list(metrics)}
+
+
+class Batcher:
+    """
+    Collects the queries that come in within BATCH_WINDOW of each other and rates them
+    together.
+    """
+    def __init__(self, ratings):
+        self.ratings = ratings
+        self.queue = asyncio.Queue()
+        self.batch_sizes = collections.Counter()
+
+    async def rate(self, query):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            deadline = loop.time() + BATCH_WINDOW
+            while len(pending) < MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batch_sizes[len(pending)] += 1
+            # One bad query (e.g. an unknown player) shouldn't fail the rest of the batch
+            valid = []
+            for query, future in pending:
+                try:
+                    self.ratings.player(query["player"])
+                    valid.append((query, future))
+                except QueryError as e:
+                    future.set_exception(e)
+            if not valid:
+                continue
+            try:
+                results = self.ratings.rate([query for query, _ in valid])
+            except Exception as e:
+                for _, future in valid:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(valid, results):
+                future.set_result(result)
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+
+    def record(self, endpoint, seconds, ok):
+        self.requests[endpoint] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+        self.latencies[endpoint].append(seconds)
+
+    def report(self, batch_sizes):
+        latency = {}
+        for endpoint, samples in self.latencies.items():
+            samples = sorted(samples)
+            latency[endpoint] = {"p" + str(p) + "_ms": 1000 * samples[min(len(samples) - 1, len(samples) * p // 100)]
+                                 for p in (50, 95, 99)}
+        return {"uptime_s": time.time() - self.started, "requests": dict(self.requests),
+                "errors": dict(self.errors), "latency": latency,
+                "batch_sizes": {str(size): count for size, count in sorted(batch_sizes.items())}}
+
+
+class Service:
+    def __init__(self, ratings):
+        self.ratings = ratings
+        self.batcher = None
+        self.port = None
+        self.metrics = Metrics()
+
+    async def handle(self, method, path, body):
+        """
+        Returns (status, response object) of one request.
+        """
+        url = urlsplit(path)
+        if url.path == "/metrics":
+            return 200, self.metrics.report(self.batcher.batch_sizes)
+        if url.path != "/ratings":
+            return 404, {"error": "Not found"}
+
+        if method == "GET":
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            return 200, await self.batcher.rate(parse_query(params))
+        if method == "POST":
+            try:
+                queries = json.loads(body or b"[]")
+            except ValueError:
+                queries = None
+            if not isinstance(queries, list):
+                raise QueryError("The body must be a JSON list of queries")
+            return 200, await asyncio.gather(*[self.rate_query(query) for query in queries])
+        return 405, {"error": "Use GET or POST"}
+
+    async def rate_query(self, params):
+        """
+        One query of a POST, a bad query gets its error instead of failing the others.
+        """
+        try:
+            return await self.batcher.rate(parse_query(params))
+        except QueryError as e:
+            return {"error": str(e)}
+
+    async def connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if len(request_line) < 2:
+                return
+
+            start = time.perf_counter()
+            endpoint = urlsplit(request_line[1]).path
+            try:
+                status, response = await self.handle(request_line[0], request_line[1], body)
+            except QueryError as e:
+                status, response = 400, {"error": str(e)}
+            except Exception as e:
+                # Still answer (and count) the request, instead of dropping the connection
+                status, response = 500, {"error": type(e).__name__ + ": " + str(e)}
+            self.metrics.record(endpoint, time.perf_counter() - start, status == 200)
+
+            data = json.dumps(response).encode()
+            writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n"
+                          "Content-Length: %d\r\nConnection: close\r\n\r\n" %
+                          (status, STATUS_TEXT[status], len(data))).encode() + data)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.batcher = Batcher(self.ratings)
+        batcher_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.connection, host, port)
+        # The port actually bound, for port 0
+        self.port = server.sockets[0].getsockname()[1]
+        print("Serving ratings on http://%s:%d" % (host, self.port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP service for ratings on demand")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    boxscores, _ = store.build_store()
+    try:
+        asyncio.run(Service(Ratings(boxscores)).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
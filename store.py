@@ -0,0 +1,361 @@
+import csv
+import json
+import os
+import uuid
+
+import numpy as np
+
+import build_data
+import league
+import schema
+
+"""
+Columnar store for the boxscores in data/boxscores.
+
+Every YYYYMMDD.csv file is parsed once into a single array of fixed width records (one
+per player row) that is saved with numpy and memory-mapped on load, so loading a whole
+career is one mmap instead of ~1,400 file opens. Minutes are kept as integer seconds,
+and "nan"/DNP values are stored as MISSING.
+
+Files written to the store directory, the ones of one build all named with its build id:
+    store.json          -> the build id of the current build, the store is whatever it names
+    rows-<build>.npy     -> ROW_DTYPE records, one per player row, ordered by game
+    games-<build>.npy    -> GAME_DTYPE records, one per boxscore file (date, row slice, mtime)
+    players-<build>.json -> player names, the "player" field of a row indexes this list
+    files-<build>.json   -> the boxscore file name of every game
+
+Files are named by the date of the game, either YYYYMMDD.csv (one game a day, like our
+data/boxscores) or with more after the date (e.g. YYYYMMDD0CLE.csv) when there are more.
+"""
+
+BOXSCORE_DIR = "data/boxscores"
+STORE_DIR = "data/store"
+
+MANIFEST = "store.json"
+
+# Files of one build, by what they hold
+STORE_FILES = {"rows": "rows-%s.npy", "games": "games-%s.npy", "players": "players-%s.json",
+               "files": "files-%s.json"}
+
+STATS = ["FGM","FGA","3PM","3PA","FTM","FTA","ORB","DRB","TRB","AST","STL","BLK","TOV","PF","PTS"]
+
+# Value used for any stat we couldn't read (nan, blank, "Did Not Play"...)
+MISSING = -1
+
+ROW_DTYPE = np.dtype([("game", "<i4"), ("team", "i1"), ("player", "<i4"), ("MP", "<i4")] +
+                     [(stat, "<i2") for stat in STATS])
+GAME_DTYPE = np.dtype([("date", "<i4"), ("start", "<i8"), ("stop", "<i8"), ("mtime", "<i8")])
+
+
+def parse_stat(val):
+    if val.isdigit():
+        return int(val)
+    return MISSING
+
+
+class BoxscoreStore:
+    """
+    Read only view of a built store. rows/games are (usually memory-mapped) numpy arrays,
+    players is the list of player names and files the file name of every game.
+    """
+    def __init__(self, rows, games, players, files=None):
+        self.rows = rows
+        self.games = games
+        self.players = players
+        if files is None:
+            files = ["%d.csv" % date for date in games["date"]]
+        self.files = files
+        self._player_ids = {name: i for i, name in enumerate(players)}
+
+        # Player index: the rows of player p are _player_rows[_player_starts[p]:_player_starts[p + 1]],
+        # in game order since the sort is stable
+        player = rows["player"]
+        self._player_rows = np.argsort(player, kind="stable")
+        self._player_starts = np.zeros(len(players) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(player, minlength=len(players)), out=self._player_starts[1:])
+        self._team_totals = None
+
+    def __len__(self):
+        return len(self.games)
+
+    def game_index(self, date):
+        """
+        Returns the index of the (first) game played on date (yyyymmdd, str or int), or -1
+        """
+        date = int(date)
+        i = int(np.searchsorted(self.games["date"], date))
+        if i < len(self.games) and self.games["date"][i] == date:
+            return i
+        return -1
+
+    def game_rows(self, game):
+        start, stop = self.games["start"][game], self.games["stop"][game]
+        return self.rows[start:stop]
+
+    def player_id(self, name):
+        return self._player_ids.get(name, -1)
+
+    def player_rows(self, player):
+        """
+        Returns the indexes (into rows) of every row of a player (name or id), in game order.
+        """
+        if isinstance(player, str):
+            player = self.player_id(player)
+            if player == -1:
+                return np.zeros(0, dtype=np.int64)
+        return self._player_rows[self._player_starts[player]:self._player_starts[player + 1]]
+
+    def player_games(self, player):
+        """
+        Returns [(game, row)] for every game a player (name or id) has a row in.
+        """
+        row_idx = self.player_rows(player)
+        return list(zip(self.rows["game"][row_idx].tolist(), row_idx.tolist()))
+
+    def game_seasons(self):
+        """
+        Season of every game, games in Oct-Dec count towards the next year's season (see
+        build_data.game_season()).
+        """
+        return league.date_seasons(self.games["date"])
+
+    def team_totals(self):
+        """
+        Returns an array of shape (games, 2, 1 + len(STATS)) with the MP and STATS totals of
+        both teams in every game. It's computed once and then kept.
+        """
+        if self._team_totals is None:
+            fields = ["MP"] + STATS
+            stats = np.maximum(np.stack([self.rows[field] for field in fields], axis=1), 0)
+            totals = np.zeros((len(self.games), 2, len(fields)), dtype=np.int64)
+            np.add.at(totals, (self.rows["game"], self.rows["team"]), stats)
+            self._team_totals = totals
+        return self._team_totals
+
+    def player_columns(self, row_idx):
+        """
+        Returns the per game stats of the rows row_idx (all of the same player) as columns
+        named like the calc.py inputs: MP, FGM... for the player, Team_MP... for the player's
+        team and Opponent_MP... for the other team. Missing values count as 0.
+        """
+        fields = ["MP"] + STATS
+        rows = self.rows[row_idx]
+        totals = self.team_totals()
+        team = totals[rows["game"], rows["team"]]
+        opponent = totals[rows["game"], 1 - rows["team"]]
+
+        columns = {}
+        for i, field in enumerate(fields):
+            columns[field] = np.maximum(rows[field], 0).astype(np.int64)
+            columns["Team_" + field] = team[:, i]
+            columns["Opponent_" + field] = opponent[:, i]
+        return columns
+
+    def player_split(self, row_idx):
+        """
+        Sums up the rows row_idx (all of the same player) into a single split, like
+        build_data.sum_splits() of the splits of those games.
+        """
+        split = {"Player": {}, "Team": {}, "Opponent": {}}
+        for key, column in self.player_columns(row_idx).items():
+            name = key.split("_")[0] if "_" in key else "Player"
+            split[name][key] = int(column.sum())
+        return split
+
+    def game_splits(self, game):
+        """
+        Splits of every player in a game, like build_data.split_all_players(), in one pass
+        over the rows of the game. Missing values count as 0.
+        """
+        rows = self.game_rows(game)
+        fields = ["MP"] + STATS
+        stats = np.maximum(np.stack([rows[field] for field in fields], axis=1), 0).astype(np.int64)
+        team = rows["team"]
+
+        totals = []
+        for t in (0, 1):
+            team_sum = dict(zip(fields, stats[team == t].sum(axis=0).tolist()))
+            totals.append(({"Team_" + stat: val for stat, val in team_sum.items()},
+                           {"Opponent_" + stat: val for stat, val in team_sum.items()}))
+
+        splits = {}
+        for player, t, row in zip(rows["player"].tolist(), team.tolist(), stats.tolist()):
+            player_split = dict(zip(fields, row))
+            player_split["Team"] = t
+            splits[self.players[player]] = {"Player": player_split, "Opponent": totals[1 - t][1],
+                                            "Team": totals[t][0]}
+        return splits
+
+
+def parse_boxscore_file(fname, game, player_ids, players):
+    """
+    Parses one boxscore CSV into ROW_DTYPE records. New player names are appended to
+    players (and player_ids) so that existing ids never change between builds.
+    """
+    records = []
+    with open(fname) as csvfile:
+        for row in csv.DictReader(csvfile):
+            # Skip the team totals, including the ones that got saved offset by 1, and rows
+            # without a team to put them on (like schema.parse_repair())
+            if row["Player"].isdigit() or row["Player"] == "Team Totals":
+                continue
+            if row["Team"] not in ("0", "1"):
+                continue
+
+            player = player_ids.get(row["Player"])
+            if player is None:
+                player = len(players)
+                player_ids[row["Player"]] = player
+                players.append(row["Player"])
+
+            minutes = build_data.parse_minutes(row["MP"], MISSING)
+            records.append((game, int(row["Team"]), player, minutes) +
+                           tuple(parse_stat(row[stat]) for stat in STATS))
+    return np.array(records, dtype=ROW_DTYPE)
+
+def parse_clean_file(fname, game, player_ids, players):
+    """
+    parse_boxscore_file() for a file that validated clean (see schema.py): every column is
+    where schema.HEADER says and every stat of a player who played is a number, so there
+    are no checks. Players who didn't play get MISSING, like in parse_boxscore_file().
+    """
+    missing = (MISSING,) * len(STATS)
+    records = []
+    with open(fname) as csvfile:
+        lines = csv.reader(csvfile)
+        next(lines)
+        for line in lines:
+            name = line[schema.PLAYER_COLUMN]
+            if name == "Team Totals" or name.isdigit():
+                continue
+
+            player = player_ids.get(name)
+            if player is None:
+                player = len(players)
+                player_ids[name] = player
+                players.append(name)
+
+            team = int(line[schema.TEAM_COLUMN])
+            mp = line[schema.MP_COLUMN]
+            if ":" in mp:
+                mins, secs = mp.split(":")
+                records.append((game, team, player, int(mins) * 60 + int(secs)) +
+                               tuple(int(line[i]) for i in schema.COUNT_COLUMNS))
+            else:
+                records.append((game, team, player, MISSING) + missing)
+    return np.array(records, dtype=ROW_DTYPE)
+
+def store_files(store_dir, build):
+    return {key: os.path.join(store_dir, name % build) for key, name in STORE_FILES.items()}
+
+def load_store(store_dir=STORE_DIR, mmap_mode="r"):
+    """
+    Loads the store previously written by build_store(). Returns None if there isn't one.
+    """
+    try:
+        with open(os.path.join(store_dir, MANIFEST)) as f:
+            paths = store_files(store_dir, json.load(f)["build"])
+        rows = np.load(paths["rows"], mmap_mode=mmap_mode)
+        games = np.load(paths["games"])
+        with open(paths["players"]) as f:
+            players = json.load(f)
+        with open(paths["files"]) as f:
+            files = json.load(f)
+    except FileNotFoundError:
+        return None
+    return BoxscoreStore(rows, games, players, files)
+
+def build_store(boxscore_dir=BOXSCORE_DIR, store_dir=STORE_DIR, fnames=None, ingest=None):
+    """
+    Builds (or refreshes) the store from every csv in boxscore_dir, or only the files named
+    in fnames. Files whose mtime hasn't changed since the last build are copied over from
+    the old store instead of being parsed again, the others are parsed according to their
+    ingest status (a schema.IngestLog, the one in data/cache by default, saved at the end;
+    a log passed in is left for the caller to save). Returns the loaded store and the
+    number of files (re)parsed.
+    """
+    own_ingest = ingest is None
+    if own_ingest:
+        ingest = schema.IngestLog()
+    old = load_store(store_dir, mmap_mode=None)
+    if old is not None:
+        old_games = {fname: i for i, fname in enumerate(old.files)}
+        players = list(old.players)
+    else:
+        old_games = {}
+        players = []
+    player_ids = {name: i for i, name in enumerate(players)}
+
+    if fnames is None:
+        fnames = os.listdir(boxscore_dir)
+    fnames = sorted(f for f in fnames if f.endswith(".csv"))
+    games = np.zeros(len(fnames), dtype=GAME_DTYPE)
+    chunks = []
+    parsed = 0
+    start = 0
+    for game, fname in enumerate(fnames):
+        path = os.path.join(boxscore_dir, fname)
+        date = int(fname[:8])
+        mtime = os.stat(path).st_mtime_ns
+
+        old_game = old_games.get(fname)
+        if old_game is not None and old.games["mtime"][old_game] == mtime:
+            chunk = np.array(old.game_rows(old_game))
+            chunk["game"] = game
+        else:
+            if ingest.status(path) == schema.CLEAN:
+                chunk = parse_clean_file(path, game, player_ids, players)
+            else:
+                chunk = parse_boxscore_file(path, game, player_ids, players)
+            parsed += 1
+
+        games[game] = (date, start, start + len(chunk), mtime)
+        start += len(chunk)
+        chunks.append(chunk)
+
+    if parsed or old is None or list(old.files) != fnames:
+        rows = np.concatenate(chunks) if chunks else np.zeros(0, dtype=ROW_DTYPE)
+        save_store(store_dir, rows, games, players, fnames)
+    if own_ingest:
+        ingest.save()
+    return load_store(store_dir), parsed
+
+def save_store(store_dir, rows, games, players, files):
+    """
+    Writes the store as a new build next to the current one, then points store.json at it
+    (os.replace() of a temp file, which is atomic) and only then removes the old build. A
+    crash at any point leaves store.json naming one complete build, the old or the new one,
+    never rows of one build with the games of another.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    build = uuid.uuid4().hex
+    paths = store_files(store_dir, build)
+
+    for key, write in [("rows", lambda f: np.save(f, rows)),
+                       ("games", lambda f: np.save(f, games)),
+                       ("players", lambda f: f.write(json.dumps(players).encode())),
+                       ("files", lambda f: f.write(json.dumps(files).encode()))]:
+        with open(paths[key], "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    manifest = os.path.join(store_dir, MANIFEST)
+    with open(manifest + ".tmp", "w") as f:
+        json.dump({"build": build}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest + ".tmp", manifest)
+
+    # Old builds, and the files of a build that crashed before it got to store.json
+    current = set(os.path.basename(path) for path in paths.values())
+    prefixes = tuple(name.split("%s")[0] for name in STORE_FILES.values())
+    for name in os.listdir(store_dir):
+        if name.startswith(prefixes) and name not in current:
+            os.remove(os.path.join(store_dir, name))
+
+
+if __name__ == "__main__":
+    store, parsed = build_store()
+    print("Parsed " + str(parsed) + " boxscore files, store has " + str(len(store)) +
+          " games and " + str(len(store.rows)) + " player rows")
@@ -0,0 +1,72 @@
+"""
+Canned basketball-reference boxscore pages for the scraper tests (and bench.py parse),
+built out of the rows of one of our boxscore CSVs.
+"""
+
+HTML_COLUMNS = ["Starters","MP","FG","FGA","FG%","3P","3PA","3P%","FT","FTA","FT%","ORB",
+                "DRB","TRB","AST","STL","BLK","TOV","PF","PTS","+/-"]
+ADVANCED_COLUMNS = ["Starters","MP","TS%","eFG%","3PAr","FTr","ORB%","DRB%","TRB%","AST%",
+                    "STL%","BLK%","TOV%","USG%","ORtg","DRtg"]
+
+
+def html_table(table_id, columns, rows):
+    """
+    Builds one stats table the way basketball-reference lays them out, including the over
+    header row, the "Reserves" row after the starters and the totals in the footer.
+    """
+    out = ['<table class="sortable stats_table" id="' + table_id + '" data-cols-to-freeze=",1">',
+           '<thead><tr class="over_header"><th colspan="2"></th>'
+           '<th colspan="' + str(len(columns) - 1) + '" class="over_header center">Box Score</th></tr>',
+           '<tr>' + "".join('<th aria-label="' + c + '" data-stat="' + c + '" scope="col">' + c + '</th>'
+                            for c in columns) + '</tr></thead><tbody>']
+    totals = None
+    for i, row in enumerate(rows):
+        if row[0] == "Team Totals":
+            totals = row
+            continue
+        if i == 5:
+            out.append('<tr class="thead">' + "".join('<th>' + c + '</th>' for c in
+                       ["Reserves"] + columns[1:]) + '</tr>')
+        cells = '<th scope="row" class="left" data-stat="player"><a href="/players/x/x01.html">' + row[0] + '</a></th>'
+        if not row[1][0].isdigit():
+            cells += '<td class="center" data-stat="reason" colspan="' + str(len(columns) - 1) + '">' + row[1] + '</td>'
+        else:
+            cells += "".join('<td class="right" data-stat="' + c + '">' + ("" if v == "nan" else v) + '</td>'
+                             for c, v in zip(columns[1:], row[1:]))
+        out.append('<tr>' + cells + '</tr>')
+    out.append('</tbody><tfoot>')
+    if totals is not None:
+        out.append('<tr><th scope="row" class="left" data-stat="player">Team Totals</th>' +
+                   "".join('<td class="right">' + ("" if v == "nan" else v) + '</td>'
+                           for v in totals[1:]) + '</tr>')
+    out.append('</tfoot></table>')
+    return "\n".join(out)
+
+def boxscore_page(rows):
+    """
+    Builds a page that looks like a basketball-reference boxscore out of the rows of one of
+    our boxscore CSVs. Besides the 2 basic tables there are the advanced tables and a
+    commented out table, like on the real thing.
+    """
+    teams = [[], []]
+    for row in rows:
+        if row["Player"].isdigit():
+            # Offset team totals row, see build_data.split_data()
+            values = ["Team Totals"] + [row[f] for f in ["Player","MP","FGM","FGA","FG%","3PM","3PA",
+                      "3P%","FTM","FTA","FT%","ORB","DRB","TRB","AST","STL","BLK","TOV","PF","PTS"]]
+        else:
+            values = [row[f] for f in ["Player","MP","FGM","FGA","FG%","3PM","3PA","3P%","FTM",
+                      "FTA","FT%","ORB","DRB","TRB","AST","STL","BLK","TOV","PF","PTS","+/-"]]
+        teams[int(row["Team"])].append(values)
+
+    parts = ['<!DOCTYPE html><html><head><title>Box Score</title>',
+             '<script>' + "var x = 1;\n" * 500 + '</script></head><body><div id="wrap">',
+             '<div class="scorebox">' + '<div><a href="/teams/XXX/2004.html">Team</a></div>' * 20 + '</div>']
+    for i, team in enumerate(teams):
+        parts.append(html_table("box-T" + str(i) + "-game-basic", HTML_COLUMNS, team))
+        advanced = [row[:2] + ["nan"] * (len(ADVANCED_COLUMNS) - 2) for row in team]
+        parts.append(html_table("box-T" + str(i) + "-game-advanced", ADVANCED_COLUMNS, advanced))
+    parts.append('<div class="placeholder"></div><!--\n' +
+                 html_table("four_factors", HTML_COLUMNS, teams[0]) + '\n-->')
+    parts.append('<div id="footer">' + '<p>Footer <a href="/">link</a></p>' * 200 + '</div></div></body></html>')
+    return "\n".join(parts)
@@ -0,0 +1,32 @@
+import math
+import os
+
+import pytest
+
+import build_data
+
+METRICS = ["OffensiveWinShares", "DefensiveWinShares", "DRtg", "ORtg"]
+
+
+@pytest.mark.parametrize("date", ["20031029", "20131029"])
+def test_rate_players_rates_every_player_of_a_game(date):
+    # Both games have players with no free throw attempts and players who didn't play
+    rows = build_data.load_boxscore_rows(os.path.join(build_data.BOXSCORE_DIR, date + ".csv"))
+    splits = build_data.split_all_players(rows)
+    rated = build_data.rate_players(splits, build_data.load_league_info(date))
+
+    played = {row["Player"] for row in rows if build_data.is_player_row(row) and row["MP"] > 0}
+    assert set(rated) == played
+    assert any(stats["FTA"] == 0 for stats in rated.values())
+    for stats in rated.values():
+        assert all(isinstance(stats[metric], float) for metric in METRICS)
+        # Only a rating per possession can be undefined, for a player with no possessions
+        assert math.isfinite(stats["DRtg"]) and math.isfinite(stats["DefensiveWinShares"])
+
+def test_rate_players_matches_a_single_player():
+    rows = build_data.load_boxscore_rows(os.path.join(build_data.BOXSCORE_DIR, "20031029.csv"))
+    info = build_data.load_league_info("20031029")
+    rated = build_data.rate_players(build_data.split_all_players(rows), info)
+    single = build_data.calculate_advanced_stats(dict(build_data.split_data(rows), LeagueInfo=info))
+    for metric in METRICS:
+        assert rated["LeBron James"][metric] == pytest.approx(single[metric], rel=1e-12)
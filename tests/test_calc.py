@@ -0,0 +1,28 @@
+import math
+import os
+
+import pytest
+
+import build_data
+import calc
+
+DATE = "20031029"
+
+
+def game_data():
+    rows = build_data.load_boxscore_rows(os.path.join(build_data.BOXSCORE_DIR, DATE + ".csv"))
+    split = build_data.split_data(rows)
+    return build_data.convert_data({**split["Player"], **split["Opponent"], **split["Team"],
+                                    **build_data.load_league_info(DATE)})
+
+def test_evaluate_matches_calling_the_formulas():
+    data = game_data()
+    values = calc.evaluate(data, list(calc.TERMS))
+    for name, func in calc.TERMS.items():
+        assert values[name] == pytest.approx(func(data), rel=1e-12), name
+
+def test_steps_see_the_module_globals():
+    # A formula may use math or a module constant, the compiled steps have to see them too
+    for step in calc.term_steps().values():
+        assert step.__globals__["math"] is math
+        assert step.__globals__["ZERO_WHEN_NONE"] is calc.ZERO_WHEN_NONE
@@ -0,0 +1,16 @@
+import parallel
+
+
+def test_rate_seasons_skips_seasons_without_games(tmp_path):
+    # No store yet, so it's built first
+    store_dir = str(tmp_path / "store")
+    results = parallel.rate_seasons(["LeBron James", "Nobody"], [2004, 2005, 2003], workers=1,
+                                    store_dir=store_dir)
+    assert list(results) == [("LeBron James", 2004), ("LeBron James", 2005)]
+    assert results[("LeBron James", 2004)]["ORtg"] > 0
+
+    # 20031029 is a 2004 game, so there are no games left for 2005
+    results = parallel.rate_seasons(["LeBron James"], [2004, 2005],
+                                    {2004: ["20031029"], 2005: ["20031029"]}, workers=1,
+                                    store_dir=store_dir)
+    assert list(results) == [("LeBron James", 2004)]
@@ -0,0 +1,28 @@
+import json
+import os
+import shutil
+
+import partitions
+import store
+
+FILES = ["20031029.csv", "20031030.csv", "20041103.csv", "20041104.csv"]
+
+
+def test_build_partitions_keeps_the_ingest_entries_of_every_worker(tmp_path):
+    boxscore_dir = tmp_path / "boxscores"
+    boxscore_dir.mkdir()
+    for fname in FILES:
+        shutil.copy(os.path.join(store.BOXSCORE_DIR, fname), str(boxscore_dir))
+    ingest_log = str(tmp_path / "ingest.json")
+
+    parsed = partitions.build_partitions(str(boxscore_dir), str(tmp_path / "seasons"), 2,
+                                         ingest_log)
+    assert parsed == {2004: 2, 2005: 2}
+    with open(ingest_log) as f:
+        entries = json.load(f)["files"]
+    assert sorted(entries) == sorted(str(boxscore_dir / fname) for fname in FILES)
+
+    # Nothing changed, so nothing is parsed or validated again
+    parsed = partitions.build_partitions(str(boxscore_dir), str(tmp_path / "seasons"), 2,
+                                         ingest_log)
+    assert parsed == {2004: 0, 2005: 0}
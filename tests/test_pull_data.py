@@ -0,0 +1,130 @@
+import csv
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import pull_data
+from boxscore_pages import boxscore_page
+
+DATE = "20031029"
+HOME = "SAC"
+
+
+class BoxscoreServer:
+    """
+    A stand-in for basketball-reference on localhost. responses maps a path to the list of
+    status codes to answer with in turn (the last one repeats), a 200 serves page. Every
+    request's path is kept in requests.
+    """
+    def __init__(self, page, responses):
+        self.page = page.encode()
+        self.responses = responses
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                statuses = server.responses.get(self.path, [404])
+                status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+                body = server.page if status == 200 else b"error"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = "http://127.0.0.1:" + str(self.httpd.server_address[1]) + "/boxscores/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def load_rows(fname):
+    with open(fname) as csvfile:
+        return list(csv.DictReader(csvfile))
+
+def game_path(date, home_team):
+    return "/boxscores/" + date + "0" + home_team + ".html"
+
+@pytest.fixture
+def page():
+    return boxscore_page(load_rows(os.path.join(pull_data.BOXSCORE_DIR, DATE + ".csv")))
+
+@pytest.fixture
+def serve(page):
+    servers = []
+
+    def start(responses):
+        servers.append(BoxscoreServer(page, responses))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+def fetch(server, games, out_dir, manifest):
+    return pull_data.fetch_boxscores(games, workers=2, rate=0, base_url=server.base_url,
+                                     out_dir=str(out_dir), manifest=manifest, backoff=0)
+
+
+def test_retries_a_503(serve, tmp_path):
+    server = serve({game_path(DATE, HOME): [503, 503, 200]})
+    manifest = pull_data.Manifest(str(tmp_path / "manifest.json"))
+
+    assert fetch(server, [(DATE, HOME)], tmp_path, manifest) == {}
+    assert server.requests == [game_path(DATE, HOME)] * 3
+    fname = str(tmp_path / (DATE + ".csv"))
+    assert manifest.checksums[DATE] == pull_data.file_checksum(fname)
+    # Same players and stats as the file the page was made of (some of whose totals rows
+    # are offset)
+    def players(fname):
+        return [row for row in load_rows(fname)
+                if row["Player"] != "Team Totals" and not row["Player"].isdigit()]
+    assert players(fname) == players(os.path.join(pull_data.BOXSCORE_DIR, DATE + ".csv"))
+
+def test_reports_a_404_and_fetches_the_rest(serve, tmp_path):
+    server = serve({game_path(DATE, HOME): [200]})
+    manifest = pull_data.Manifest(str(tmp_path / "manifest.json"))
+
+    errors = fetch(server, [(DATE, HOME), ("20031030", "CLE")], tmp_path, manifest)
+    assert list(errors) == ["20031030"]
+    assert "404" in str(errors["20031030"])
+    # Not retried, and nothing is saved for it
+    assert server.requests.count(game_path("20031030", "CLE")) == 1
+    assert not os.path.exists(tmp_path / "20031030.csv")
+    assert list(manifest.checksums) == [DATE]
+
+def test_skips_present_boxscores(serve, tmp_path):
+    server = serve({game_path(DATE, HOME): [200]})
+    fname = str(tmp_path / "manifest.json")
+    assert fetch(server, [(DATE, HOME)], tmp_path, pull_data.Manifest(fname)) == {}
+    assert len(server.requests) == 1
+
+    # A rerun reads the manifest back and has nothing to do
+    assert fetch(server, [(DATE, HOME)], tmp_path, pull_data.Manifest(fname)) == {}
+    assert len(server.requests) == 1
+
+def test_refetches_a_corrupted_boxscore(serve, tmp_path):
+    server = serve({game_path(DATE, HOME): [200]})
+    fname = str(tmp_path / "manifest.json")
+    assert fetch(server, [(DATE, HOME)], tmp_path, pull_data.Manifest(fname)) == {}
+    boxscore = str(tmp_path / (DATE + ".csv"))
+    checksum = pull_data.file_checksum(boxscore)
+
+    # Cut off half way, the file no longer matches its checksum in the manifest
+    with open(boxscore, "r+") as f:
+        f.truncate(os.path.getsize(boxscore) // 2)
+    manifest = pull_data.Manifest(fname)
+    assert not manifest.is_present(DATE, str(tmp_path))
+
+    assert fetch(server, [(DATE, HOME)], tmp_path, manifest) == {}
+    assert len(server.requests) == 2
+    assert pull_data.file_checksum(boxscore) == checksum
+    assert manifest.is_present(DATE, str(tmp_path))
@@ -0,0 +1,15 @@
+import cli
+import ratings_cache
+
+DATES = ["20031029", "20031030"]
+
+
+def test_no_ratings_without_games(tmp_path):
+    cache = ratings_cache.RatingsCache(str(tmp_path / "ratings.db"))
+    assert ratings_cache.season_ratings(cache, "Nobody", 2004, DATES) is None
+    assert ratings_cache.season_ratings(cache, "LeBron James", 2004, DATES) is not None
+    cache.close()
+
+def test_rate_command_fails_for_an_unknown_player(capsys):
+    assert cli.main(["rate", "--player", "Nobody", "--season", "2004", "--career"]) == 1
+    assert "Nobody didn't play" in capsys.readouterr().out
@@ -0,0 +1,12 @@
+import numpy as np
+import pytest
+
+import rolling
+
+
+@pytest.mark.parametrize("window", [0, -1])
+def test_window_must_be_positive(window):
+    with pytest.raises(ValueError):
+        rolling.rolling_ratings(np.array([20031029, 20031030]), {}, window)
+    with pytest.raises(ValueError):
+        rolling.RollingRatings(window)
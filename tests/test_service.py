@@ -0,0 +1,99 @@
+import asyncio
+import http.client
+import json
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+import schema
+import service
+import store
+
+FILES = ["20031029.csv", "20031030.csv", "20031101.csv"]
+
+
+@pytest.fixture
+def server(tmp_path):
+    boxscore_dir = tmp_path / "boxscores"
+    boxscore_dir.mkdir()
+    for fname in FILES:
+        shutil.copy(os.path.join(store.BOXSCORE_DIR, fname), str(boxscore_dir))
+    boxscores, _ = store.build_store(str(boxscore_dir), str(tmp_path / "store"),
+                                     ingest=schema.IngestLog(str(tmp_path / "ingest.json")))
+
+    svc = service.Service(service.Ratings(boxscores))
+    running = {}
+
+    async def serve():
+        running["loop"], running["task"] = asyncio.get_running_loop(), asyncio.current_task()
+        await svc.serve("127.0.0.1", 0)
+
+    def run():
+        try:
+            asyncio.run(serve())
+        except asyncio.CancelledError:
+            pass
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while svc.port is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield svc
+
+    running["loop"].call_soon_threadsafe(running["task"].cancel)
+    thread.join()
+
+def request(svc, method, path, body=None):
+    connection = http.client.HTTPConnection("127.0.0.1", svc.port, timeout=10)
+    connection.request(method, path, body=None if body is None else json.dumps(body))
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+def test_get(server):
+    status, ratings = request(server, "GET", "/ratings?player=LeBron%20James&start=20031029"
+                                             "&end=20031030&metrics=ORtg,DRtg")
+    assert status == 200
+    assert set(ratings) == {"ORtg", "DRtg"}
+    assert all(isinstance(value, float) for value in ratings.values())
+
+    # No games in the range
+    status, ratings = request(server, "GET", "/ratings?player=LeBron%20James&start=20040101")
+    assert status == 200
+    assert ratings == {"ORtg": None, "DRtg": None}
+
+def test_post_answers_every_query(server):
+    _, single = request(server, "GET", "/ratings?player=LeBron%20James")
+    status, results = request(server, "POST", "/ratings",
+                              [{"player": "LeBron James"}, {"player": "Nobody"},
+                               {"player": "LeBron James", "metrics": ["Nope"]}])
+    assert status == 200
+    assert results == [single, {"error": "Unknown player: Nobody"},
+                       {"error": "Unknown metric: \"Nope\""}]
+
+def test_errors(server, monkeypatch):
+    assert request(server, "GET", "/ratings")[0] == 400
+    assert request(server, "POST", "/ratings", {"player": "LeBron James"})[0] == 400
+    assert request(server, "GET", "/nope")[0] == 404
+    assert request(server, "PUT", "/ratings")[0] == 405
+
+    def fail(queries):
+        raise RuntimeError("broken")
+    monkeypatch.setattr(server.ratings, "rate", fail)
+    assert request(server, "GET", "/ratings?player=LeBron%20James") == \
+        (500, {"error": "RuntimeError: broken"})
+
+def test_metrics(server):
+    request(server, "GET", "/ratings?player=LeBron%20James")
+    request(server, "GET", "/ratings")
+    status, report = request(server, "GET", "/metrics")
+    assert status == 200
+    assert report["requests"] == {"/ratings": 2}
+    assert report["errors"] == {"/ratings": 1}
+    assert set(report["latency"]["/ratings"]) == {"p50_ms", "p95_ms", "p99_ms"}
+    assert sum(report["batch_sizes"].values()) == 1
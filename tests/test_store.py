@@ -0,0 +1,33 @@
+import csv
+import os
+import shutil
+
+import schema
+import store
+
+DATE = "20031030"
+
+
+def test_build_store_repairs_a_row_without_team(tmp_path):
+    boxscore_dir = tmp_path / "boxscores"
+    boxscore_dir.mkdir()
+    fname = str(boxscore_dir / (DATE + ".csv"))
+    shutil.copy(os.path.join(store.BOXSCORE_DIR, DATE + ".csv"), fname)
+    with open(fname) as f:
+        lines = f.read().split("\n")
+    # Blank the Team of the 3rd player
+    lines[3] = lines[3][:lines[3].rindex(",") + 1]
+    with open(fname, "w") as f:
+        f.write("\n".join(lines))
+
+    ingest = schema.IngestLog(str(tmp_path / "ingest.json"))
+    assert ingest.status(fname) == schema.REPAIR
+    boxscores, parsed = store.build_store(str(boxscore_dir), str(tmp_path / "store"),
+                                          ingest=ingest)
+
+    assert parsed == 1
+    # The row without a team is left out, like schema.parse_repair() does
+    with open(fname) as csvfile:
+        players = [row[0] for row in schema.parse_repair(csv.DictReader(csvfile))]
+    assert [boxscores.players[i] for i in boxscores.rows["player"]] == players
+    assert "Zydrunas Ilgauskas" not in players
@@ -0,0 +1,176 @@
+import itertools
+
+import numpy as np
+
+import batch
+import calc
+
+"""
+What-if / sensitivity analysis of the calc.py metrics.
+
+what_if() takes a base record (a flat dict of inputs like the one calculate_advanced_stats()
+works on, or a records.StatRecord) and a grid of changes to some of its inputs, and rates
+every combination in one batch.evaluate() call: the changed inputs become columns with one
+element per variant and everything else stays a scalar.
+
+For derivatives of each metric with respect to each input there are two ways:
+
+    numerical_derivatives() -> central differences, all 2 * inputs variants in one batch
+    analytic_derivatives()  -> exact, by running the formulas once on dual numbers that carry
+                               the gradient along with every value (forward mode)
+
+Note the inputs are totals, so for a season "one more assist per game" is a change of
+(games played) in AST.
+
+    python whatif.py [season]
+"""
+
+METRICS = ["ORtg", "DRtg", "OffensiveWinShares", "DefensiveWinShares"]
+
+
+def base_inputs(record, metrics=METRICS):
+    """
+    The inputs of record the metrics depend on, as floats.
+    """
+    return {key: float(record[key]) for key in sorted(calc.dependencies(*metrics)[1])}
+
+def what_if(record, grid, metrics=METRICS, relative=False):
+    """
+    Rates every combination of the changes in grid ({input: [changes]}). Changes are added
+    to the base value, or multiply it with relative. Returns (changes, ratings), both
+    {name: array} with one element per variant, in itertools.product() order of the grid.
+    """
+    inputs = base_inputs(record, metrics)
+    names = list(grid)
+    changes = np.array(list(itertools.product(*[grid[name] for name in names])), dtype=np.float64)
+    changes = changes.reshape(-1, len(names))
+
+    columns = dict(inputs)
+    for i, name in enumerate(names):
+        if relative:
+            columns[name] = inputs[name] * changes[:, i]
+        else:
+            columns[name] = inputs[name] + changes[:, i]
+    ratings = batch.evaluate(columns, metrics)
+    return {name: changes[:, i] for i, name in enumerate(names)}, ratings
+
+def numerical_derivatives(record, inputs=None, metrics=METRICS, step=1e-6):
+    """
+    d metric / d input by central differences, with a step of step times the input (or step
+    if the input is 0). Returns {metric: {input: derivative}}.
+    """
+    base = base_inputs(record, metrics)
+    inputs = inputs or list(base)
+    steps = np.array([step * (abs(base[name]) or 1.0) for name in inputs])
+
+    # Variant 2i is input i moved down a step, 2i + 1 is moved up
+    columns = dict(base)
+    for i, name in enumerate(inputs):
+        column = np.full(2 * len(inputs), base[name])
+        column[2 * i] -= steps[i]
+        column[2 * i + 1] += steps[i]
+        columns[name] = column
+    ratings = batch.evaluate(columns, metrics)
+
+    derivatives = {}
+    for metric in metrics:
+        values = ratings[metric].reshape(len(inputs), 2)
+        slopes = (values[:, 1] - values[:, 0]) / (2 * steps)
+        derivatives[metric] = {name: float(slopes[i]) for i, name in enumerate(inputs)}
+    return derivatives
+
+
+class Dual:
+    """
+    A value together with its gradient with respect to the inputs (a vector with one
+    element per input). Supports the arithmetic the formulas use, +, -, *, / and ** with a
+    number as the exponent.
+    """
+    __slots__ = ["value", "grad"]
+
+    def __init__(self, value, grad):
+        self.value = value
+        self.grad = grad
+
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value + other.value, self.grad + other.grad)
+        return Dual(self.value + other, self.grad)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value - other.value, self.grad - other.grad)
+        return Dual(self.value - other, self.grad)
+
+    def __rsub__(self, other):
+        return Dual(other - self.value, -self.grad)
+
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value * other.value, self.grad * other.value + self.value * other.grad)
+        return Dual(self.value * other, self.grad * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value / other.value,
+                        (self.grad * other.value - self.value * other.grad) / other.value ** 2)
+        return Dual(self.value / other, self.grad / other)
+
+    def __rtruediv__(self, other):
+        return Dual(other / self.value, -other * self.grad / self.value ** 2)
+
+    def __pow__(self, exponent):
+        return Dual(self.value ** exponent, exponent * self.value ** (exponent - 1) * self.grad)
+
+    def __neg__(self):
+        return Dual(-self.value, -self.grad)
+
+def analytic_derivatives(record, inputs=None, metrics=METRICS):
+    """
+    Exact d metric / d input, from one evaluation of the formulas on dual numbers. Returns
+    {metric: {input: derivative}}. Like the scalar formulas this raises ZeroDivisionError
+    if the record has e.g. no free throw attempts.
+    """
+    base = base_inputs(record, metrics)
+    inputs = inputs or list(base)
+    data = dict(base)
+    for i, name in enumerate(inputs):
+        data[name] = Dual(base[name], np.eye(len(inputs))[i])
+
+    derivatives = {}
+    for metric, value in calc.evaluate(calc.Context(data), metrics).items():
+        grad = value.grad if isinstance(value, Dual) else np.zeros(len(inputs))
+        derivatives[metric] = {name: float(grad[i]) for i, name in enumerate(inputs)}
+    return derivatives
+
+
+if __name__ == "__main__":
+    import sys
+
+    import aggregate
+    import league
+    import records
+
+    season = int(sys.argv[1]) if len(sys.argv) > 1 else 2009
+    dates = aggregate.season_games(season)
+    total = records.sum_records(record for _, record in
+                                records.split_games(records.load_games(dates)))
+    record = total.with_league(league.league_info(season))
+
+    inputs = ["AST", "TOV", "STL", "LPPP", "Team_Pace"]
+    print("Derivatives in " + str(season) + " (per unit of each input):")
+    derivatives = analytic_derivatives(record, inputs)
+    print("%-20s" % "" + "".join("%14s" % name for name in inputs))
+    for metric in METRICS:
+        print("%-20s" % metric + "".join("%14.5f" % derivatives[metric][name] for name in inputs))
+
+    games = len(dates)
+    changes, ratings = what_if(record, {"AST": [games * n for n in (-1, 0, 1, 2)]})
+    print("\nOne more/less assist per game:")
+    for i, change in enumerate(changes["AST"]):
+        print("AST %+5d: " % change + ", ".join(metric + " = %.2f" % ratings[metric][i]
+                                               for metric in METRICS))